@@ -0,0 +1,58 @@
+""" write baseline_events.json with the readers of another version of the code, e.g. the per-frame readers the drivers
+started from:
+
+    git worktree add /tmp/baseline <commit>
+    python tests/record_baseline.py /tmp/baseline/wsg2vgm
+
+The synthetic ROMs are those of this version's benchmark """
+import os
+import sys
+import importlib
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wsg2vgm'))
+import WSGDrivers
+import test_readers
+
+
+def import_drivers(path):
+    """ the WSGDrivers module found in path, imported next to the current one """
+    modules = {name: sys.modules.pop(name) for name in ('WSG', 'WSGDrivers', 'WSGSequencer', 'WSGProfile', 'VGM')
+               if name in sys.modules}
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module('WSGDrivers')
+    finally:
+        sys.path.remove(path)
+        for name in ('WSG', 'WSGDrivers', 'WSGSequencer', 'WSGProfile', 'VGM'):
+            sys.modules.pop(name, None)
+        sys.modules.update(modules)
+
+
+def record(path):
+    drivers = import_drivers(os.path.abspath(path))
+    baseline = {}
+    for driver_name in sorted(WSGDrivers.drivers):
+        reader_name = WSGDrivers.get_driver(driver_name).reader
+        baseline[driver_name] = []
+        for seed in range(test_readers.SEEDS):
+            file_reader = test_readers.synthetic_reader(driver_name, seed)
+            songs = []
+            for song_nr in range(test_readers.SONGS):
+                # a reader per song as the original ones keep state of the last song, e.g. the loop end. The name
+                # doesn't match any of the games the original code has special cases for
+                old_reader = drivers.Reader('synthetic')
+                for name in test_readers.ADDRESSES:
+                    setattr(old_reader, name, getattr(file_reader, name))
+                old_reader.rom = file_reader.rom
+                old_reader.wavetable = file_reader.wavetable
+                songs.append(test_readers.song_digests(getattr(old_reader, reader_name), song_nr))
+            baseline[driver_name].append(dict(rom=test_readers.rom_digest(file_reader), songs=songs))
+        print(driver_name)
+
+    with open(test_readers.BASELINE, 'w') as f:
+        json.dump(baseline, f, indent=1)
+
+
+if __name__ == '__main__':
+    record(sys.argv[1])
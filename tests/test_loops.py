@@ -0,0 +1,123 @@
+""" the loops found by the Tower of Druaga driver play the same as the songs played on: the converted songs with their
+loop are played for a few passes and compared with the songs converted without loop detection, cut a pass later """
+import VGM
+import benchmark
+import wsg2vgm
+import struct
+import pytest
+
+SEEDS = 20
+SONGS = 8
+PASSES = 2
+
+
+def play(vgm, samples):
+    """ the keys and registers of the C352 played up to samples, jumping back to the loop at the end: (sample, 'on',
+    voice, registers of the voice), (sample, 'off', voice) for a voice keyed off while playing and (sample, 'reg',
+    address, value) for the registers changed by the writes of a sample. A voice keyed off and on again at the same
+    sample, at the end of a pass or between notes, is only keyed on """
+    loop = struct.unpack_from('<I', vgm, 0x1C)[0]
+    loop = loop + 0x1C if loop else None
+    offset = 0x34 + struct.unpack_from('<I', vgm, 0x34)[0]
+    sample = 0
+    registers = {}
+    written = {}
+    keys = {}
+    playing = set()
+    played = []
+
+    def update():
+        for address, value in sorted(written.items()):
+            if registers.get(address) != value:
+                registers[address] = value
+                played.append((sample, 'reg', address, value))
+        written.clear()
+
+    while sample < samples:
+        command = vgm[offset]
+        if command == 0x66:
+            if loop is None:
+                break
+            offset = loop
+        elif command == 0x67:
+            offset += 7 + struct.unpack_from('<I', vgm, offset + 3)[0]
+        elif command == 0xE1:
+            address, value = struct.unpack_from('>HH', vgm, offset + 1)
+            offset += 5
+            if address == 0x202:
+                update()
+                for voice, flags in sorted(keys.items()):
+                    if flags & VGM.C352.FLG_KEYON:
+                        playing.add(voice)
+                        played.append((sample, 'on', voice,
+                                       tuple(registers.get((voice << 4) | index) for index in range(8) if index != 3)))
+                    elif flags & VGM.C352.FLG_KEYOFF and voice in playing:
+                        playing.remove(voice)
+                        played.append((sample, 'off', voice))
+                keys.clear()
+            elif address < 0x200 and address & 0xF == 3:
+                keys[address >> 4] = value
+            else:
+                written[address] = value
+        else:
+            update()
+            if command == 0x61:
+                sample += struct.unpack_from('<H', vgm, offset + 1)[0]
+                offset += 3
+            elif command == 0x62:
+                sample += 735
+                offset += 1
+            elif command == 0x63:
+                sample += 882
+                offset += 1
+            elif command & 0xF0 == 0x70:
+                sample += (command & 0xF) + 1
+                offset += 1
+            else:
+                raise ValueError('unexpected VGM command %02X' % command)
+    keyed_on = {(event[0], event[2]) for event in played if event[1] == 'on'}
+    return [event for event in played
+            if event[0] < samples and not (event[1] == 'off' and (event[0], event[2]) in keyed_on)]
+
+
+def looped_songs():
+    for seed in range(SEEDS):
+        file_reader = benchmark.synthetic_reader('todruaga', SONGS, seed)
+        for song_nr in range(SONGS):
+            try:
+                file_reader.read(song_nr)
+            except Exception:
+                continue
+            if file_reader.loop:
+                yield seed, song_nr, file_reader.loop
+
+
+@pytest.mark.parametrize('seed, song_nr, loop', list(looped_songs()))
+def test_loop_plays_as_song(seed, song_nr, loop):
+    file_reader = benchmark.synthetic_reader('todruaga', SONGS, seed)
+    looped = wsg2vgm.convert(file_reader, song_nr)[1]
+    assert file_reader.loop == loop
+
+    # the song played on for a pass more than compared, its end with the last key offs is left out
+    loop_start, loop_length = loop
+    file_reader.songs_info = [dict(loop_end=loop_start + (PASSES + 1) * loop_length)] * SONGS
+    unlooped = wsg2vgm.convert(file_reader, song_nr)[1]
+    assert file_reader.loop is None
+
+    total, loop_offset, loop_samples = struct.unpack_from('<III', looped, 0x18)
+    assert loop_offset
+    # up to half a frame before the end of the last pass, each pass is rounded to samples so the frames start within a
+    # sample per pass of each other
+    samples = total + (PASSES - 1) * loop_samples - 44100 // 120
+    expected = play(unlooped, samples)
+    played = play(looped, samples)
+    assert [event[1:] for event in played] == [event[1:] for event in expected]
+    assert all(abs(a[0] - b[0]) <= PASSES for a, b in zip(played, expected))
+
+
+def test_loop_starts_between_notes():
+    """ the loop the tracks repeat from starts in the middle of a note of the second track, the next frame no note
+    plays through is taken """
+    file_reader = benchmark.synthetic_reader('todruaga', SONGS, 4)
+    file_reader.read(2)
+    assert file_reader.loop == (10, 110)
@@ -0,0 +1,95 @@
+""" the events of the song readers compared with those of the original per-frame readers on the synthetic ROMs of the
+benchmark. baseline_events.json holds the digests recorded with the original readers, see record_baseline.py """
+import WSGDrivers
+import benchmark
+import numpy as np
+import hashlib
+import json
+import os
+import pytest
+
+SEEDS = 10
+SONGS = 8
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_events.json')
+
+# the game addresses of get_game_info, copied to the readers of another version when recording
+ADDRESSES = ('total_songs', 'songs', 'notes', 'volumes', 'volume_length', 'voice_offset_table', 'data_addr', 'waves',
+             'song_offsets', 'note_tuning', 'decay', 'sustain', 'attack', 'attack_env', 'dur_multiplier')
+
+
+def plain(value):
+    """ an event field as plain json, the wavetables and envelopes as lists of ints """
+    if isinstance(value, np.ndarray):
+        return value.astype(int).tolist()
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    return value
+
+
+def digests(tracks):
+    """ sha1 of the events of each track """
+    result = []
+    for track in tracks:
+        events = [[type(event).__name__] + [[name, plain(value)] for name, value in sorted(vars(event).items())]
+                  for event in track]
+        result.append(hashlib.sha1(json.dumps(events).encode('utf-8')).hexdigest())
+    return result
+
+
+def rom_digest(file_reader):
+    sha = hashlib.sha1(bytes(file_reader.rom))
+    if file_reader.wavetable is not None:
+        sha.update(np.ascontiguousarray(file_reader.wavetable).tobytes())
+    return sha.hexdigest()
+
+
+def synthetic_reader(driver_name, seed):
+    """ synthetic reader of the driver with the loop detection off: the songs are played up to loop_end as the
+    original readers do """
+    file_reader = benchmark.synthetic_reader(driver_name, SONGS, seed)
+    file_reader.songs_info = [dict(loop_end=WSGDrivers.Reader.loop_end_max)] * SONGS
+    return file_reader
+
+
+def song_digests(read, song_nr):
+    """ the digests of a song or its error """
+    try:
+        return digests(read(song_nr))
+    except Exception as e:
+        return 'error: %s' % e
+
+
+def load_baseline():
+    with open(BASELINE) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('driver_name', sorted(WSGDrivers.drivers))
+def test_events_match_baseline(driver_name):
+    baseline = load_baseline()[driver_name]
+    for seed in range(SEEDS):
+        file_reader = synthetic_reader(driver_name, seed)
+        assert rom_digest(file_reader) == baseline[seed]['rom'], \
+            'the synthetic %s ROM of seed %d changed, record the baseline again' % (driver_name, seed)
+        for song_nr in range(SONGS):
+            assert song_digests(file_reader.read, song_nr) == baseline[seed]['songs'][song_nr], \
+                '%s seed %d song %d' % (driver_name, seed, song_nr)
+
+
+def test_skykid_commands_covered():
+    """ the synthetic Sky Kid songs go through the commands and envelope effects compared above """
+    ops = set()
+    effects = set()
+    for seed in range(SEEDS):
+        file_reader = synthetic_reader('skykid', seed)
+        for song_nr in range(SONGS):
+            file_reader.read(song_nr)
+        sequencer = file_reader.sequencers[WSGDrivers.SkykidTrack]
+        ops.update(instruction[1] for instruction in sequencer.cache.values())
+        effects.update(op for envelope in sequencer.envelopes.cache.values() for tick, op, arg in envelope.effects)
+    assert {0xE8, 0xE9, 0xEF, 0xF0, 0xF1, 0xF2} <= ops
+    assert effects == {0x1C, 0x1E}
@@ -1,4 +1,5 @@
 import struct
+import io
 
 
 def EndOfSound():
@@ -69,21 +70,262 @@ class GD3:
         out[8:8 + 4] = struct.pack('<I', len(out) - 12)  # data length
         return out
 
+class Writer:
+    """ a VGM file written front to back: the header is reserved, followed by the data block and the commands as they
+    are generated, then the GD3 tag. The header pointers (loop, GD3, end of file) are patched in at the end. Writes go
+    to a seekable binary file, or to memory when none is given, in linear time """
+
+    def __init__(self, file=None):
+        self.file = file if file is not None else io.BytesIO()
+        self.start = self.file.tell()
+        self.header = None
+        self.commands_offset = 0
+        self.length = 0
+        self.loop_offset = None
+
+    def __len__(self):
+        """ size of the commands written so far """
+        return self.length
+
+    def Begin(self, header, data_block):
+        self.header = header
+        self.file.write(header.data)
+        self.file.write(data_block)
+        self.commands_offset = len(header.data) + len(data_block)
+
+    def Write(self, data):
+        self.file.write(data)
+        self.length += len(data)
+
+    def MarkLoop(self):
+        self.loop_offset = self.length
+
+    def EndOfSound(self):
+        self.Write(EndOfSound())
+
+    def Finish(self, gd3, total_samples, loop_samples=None):
+        """ append the GD3 tag and patch the header, returns the file data when written to memory. loop_samples is
+        the length of the loop, all of the song by default """
+        gd3_data = gd3.get_bytes()
+        end = self.commands_offset + self.length
+        self.header.GD3Offset(end)
+        self.header.EOFOffset(end + len(gd3_data))
+        self.header.TotalSamples(total_samples)
+        if self.loop_offset is not None:
+            # relative to the end of the header
+            if loop_samples is None:
+                loop_samples = total_samples
+            self.header.Loop(self.commands_offset - len(self.header.data) + self.loop_offset, loop_samples)
+
+        self.file.write(gd3_data)
+        self.file.seek(self.start)
+        self.file.write(self.header.data)
+        self.file.seek(self.start + end + len(gd3_data))
+        if isinstance(self.file, io.BytesIO):
+            return self.file.getvalue()
+
+
+class C352Optimizer:
+    """ sits between a C352 and the writer and drops the register writes that don't change anything: a shadow copy
+    of the voice registers is kept, key on/off flags count until the next key execution (0x0202), which in turn is only
+    written when keys are pending. Delays are folded and written with the short wait commands. The shadow is cleared at
+    the loop point as the chip arrives there with the state of the song's end. The commands of other chips are passed on
+    as they are, only the delays in between are folded """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.shadow = {}
+        self.keys_pending = False
+        self.delay = 0
+        self.length = 0
+
+    def __len__(self):
+        """ size of the commands received so far """
+        return self.length
+
+    def Begin(self, header, data_block):
+        self.writer.Begin(header, data_block)
+
+    def Write(self, data):
+        self.length += len(data)
+        index = 0
+        while index < len(data):
+            command = data[index]
+            if command == 0xE1:
+                address, value = struct.unpack_from('>HH', data, index + 1)
+                self.WriteRegister(address, value, data[index:index + 5])
+                index += 5
+            elif command == 0x61:
+                self.delay += struct.unpack_from('<H', data, index + 1)[0]
+                index += 3
+            elif command == 0x62:
+                self.delay += 735
+                index += 1
+            elif command == 0x63:
+                self.delay += 882
+                index += 1
+            elif command & 0xF0 == 0x70:
+                self.delay += (command & 0xF) + 1
+                index += 1
+            else:
+                # not a C352 command, passed on as is
+                self.FlushDelay()
+                self.writer.Write(data[index:])
+                break
+
+    def WriteRegister(self, address, value, data):
+        if address == 0x0202:
+            if not self.keys_pending:
+                return
+            self.keys_pending = False
+            # the chip clears the key on/off flags it has executed
+            for flags_address in [a for a in self.shadow if a & 0xF == 3]:
+                del self.shadow[flags_address]
+        elif address < 0x200:
+            if self.shadow.get(address) == value:
+                return
+            self.shadow[address] = value
+            if address & 0xF == 3 and value & (C352.FLG_KEYON | C352.FLG_KEYOFF):
+                self.keys_pending = True
+        self.FlushDelay()
+        self.writer.Write(data)
+
+    def FlushDelay(self):
+        if self.delay:
+            self.writer.Write(Wait(self.delay))
+            self.delay = 0
+
+    def MarkLoop(self):
+        self.FlushDelay()
+        self.writer.MarkLoop()
+        self.shadow.clear()
+
+    def EndOfSound(self):
+        self.FlushDelay()
+        self.writer.EndOfSound()
+
+    def Finish(self, gd3, total_samples, loop_samples=None):
+        self.FlushDelay()
+        return self.writer.Finish(gd3, total_samples, loop_samples)
+
+
+def Wait(samples):
+    """ the shortest wait commands for a delay: 0x7n for 1-16 samples, 0x62/0x63 for a 60/50 Hz frame, 0x61 else """
+    out = bytearray()
+    while samples > 0xFFFF:
+        out += struct.pack('<BH', 0x61, 0xFFFF)
+        samples -= 0xFFFF
+    for frame_wait, command in ((735, 0x62), (882, 0x63)):
+        if frame_wait <= samples <= frame_wait + 16:
+            out.append(command)
+            samples -= frame_wait
+            break
+    if samples > 32:
+        out += struct.pack('<BH', 0x61, samples)
+    elif samples > 16:
+        out += bytes([0x7F, 0x70 | (samples - 17)])
+    elif samples:
+        out.append(0x70 | (samples - 1))
+    return bytes(out)
+
+
+class SampleBank:
+    """ allocation of the sample memory of a chip: the samples are placed one after the other in the order they are
+    added, identical samples share their slot. Instruments are looked up by key, the bank can be kept and extended
+    between songs. A sample doesn't cross a bank_size boundary """
+
+    def __init__(self, bank_size=0x10000):
+        self.bank_size = bank_size
+        self.slots = {}
+        self.samples = {}
+        self.buffer = bytearray()
+        self.data = None
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def Add(self, key, sample):
+        """ the (bank, start, end) slot of the sample, allocated unless the key or an identical sample is known """
+        slot = self.slots.get(key)
+        if slot is None:
+            sample = bytes(sample)
+            slot = self.samples.get(sample)
+            if slot is None:
+                slot = self.Allocate(sample)
+                self.samples[sample] = slot
+            self.slots[key] = slot
+        return slot
+
+    def Allocate(self, sample):
+        address = len(self.buffer)
+        if address // self.bank_size != (address + len(sample) - 1) // self.bank_size:
+            # pad to the next bank
+            self.buffer += bytes(self.bank_size - address % self.bank_size)
+            address = len(self.buffer)
+        self.buffer += sample
+        self.data = None
+        start = address % self.bank_size
+        return address // self.bank_size, start, start + len(sample) - 1
+
+    def Slot(self, key):
+        return self.slots[key]
+
+    def Data(self):
+        """ the contents of the sample memory, kept until a sample is added """
+        if self.data is None:
+            self.data = bytes(self.buffer)
+        return self.data
+
+
 class Chip:
-    def __init__(self):
+    """ the register writes of a chip. Without a writer the commands are returned as bytes, with one they are written
+    into it. The conversion targets this interface, which a chip has to provide:
+      clock_rate                                         the sample clock in Hz
+      Params()                                           [[header offset, bytes], ...] of the chip in the VGM header
+      DataBlock.FromBuffer(buffer)                       the data block command of the samples
+      FreqDiv(voice, freq_div), FreqHz(voice, note_freq) the frequency as a register value or in Hz
+      Wave(voice, wave_start, wave_end, wave_loop=-1, wave_bank=0)
+      Volume(voice, volume_left, volume_right=-1)        0-255
+      KeyOn(voice), KeyOff(voice)
+    freq_bits scales a frequency in Hz to the frequency register, frequencies past the 16 bit register are played from
+    shorter samples (see PitchTable) """
+    freq_bits = 16
+
+    def __init__(self, writer=None):
         self.delay_total = 0
+        self.overflows = 0  # frequencies clamped to the 16 bit register
+        self.writer = writer
+
+    def Emit(self, data):
+        if self.writer is None:
+            return data
+        self.writer.Write(data)
 
     def Delay(self, delay):
         self.delay_total += delay
-        out = bytes()
+        out = bytearray()
         while delay > 0xFFFF:
             out += struct.pack('<BH', 0x61, 0xFFFF)
             delay -= 0xFFFF
         out += struct.pack('<BH', 0x61, delay)
-        return out
+        return self.Emit(bytes(out))
 
     def ExecKeys(self):
-        return bytes()
+        return self.Emit(bytes())
+
+    def FreqDivider(self, note_freq):
+        """ frequency register value for a 32 sample wave played at note_freq """
+        return round(note_freq * 2 ** self.freq_bits / self.clock_rate)
+
+    def Clamp(self, freq_div):
+        """ the frequency register value limited to 16 bits, the overflows are counted """
+        if freq_div > 0xFFFF:
+            self.overflows += 1
+            freq_div = 0xFFFF
+        return freq_div
 
 
 class C352(Chip):
@@ -91,9 +333,10 @@ class C352(Chip):
     FLG_KEYOFF  = 0x2000   # Keyoff
     FLG_FILTER  = 0x0004   # don't apply filter
     FLG_LOOP    = 0x0002   # loop forward
+    freq_bits = 21  # 5 from sample length, 16 bit counter
 
-    def __init__(self, clock_freq=24576000, clock_div=288):
-        super().__init__()
+    def __init__(self, clock_freq=24576000, clock_div=288, writer=None):
+        super().__init__(writer)
         self.clock_freq = clock_freq
         self.clock_div = clock_div
         self.clock_rate = self.clock_freq / self.clock_div
@@ -114,10 +357,7 @@ class C352(Chip):
 
         @staticmethod
         def FromSamples(samples):
-            sample_data = bytes()
-            for s in samples:
-                sample_data += s
-            return C352.DataBlock.FromBuffer(sample_data)
+            return C352.DataBlock.FromBuffer(b''.join(samples))
 
     @staticmethod
     def Write(address, value):
@@ -127,43 +367,39 @@ class C352(Chip):
         return self.Write((voice_nr << 4) | offset, value)
 
     def ExecKeys(self):
-        return self.Write(0x0202, 0x0020)
+        return self.Emit(self.Write(0x0202, 0x0020))
 
     def KeyOn(self, voice):
-        return self.Voice(voice, 3, C352.FLG_KEYON | C352.FLG_FILTER | C352.FLG_LOOP)
+        return self.Emit(self.Voice(voice, 3, C352.FLG_KEYON | C352.FLG_FILTER | C352.FLG_LOOP))
 
     def KeyOff(self, voice):
-        return self.Voice(voice, 3, C352.FLG_KEYOFF | C352.FLG_FILTER | C352.FLG_LOOP)
+        return self.Emit(self.Voice(voice, 3, C352.FLG_KEYOFF | C352.FLG_FILTER | C352.FLG_LOOP))
 
     def Volume(self, voice, volume_left, volume_right=-1):
         if volume_right == -1:
             volume_right = volume_left
-        return self.Voice(voice, 0, (volume_left << 8) | volume_right)
+        return self.Emit(self.Voice(voice, 0, (volume_left << 8) | volume_right))
 
     def FreqHz(self, voice, note_freq):
-        freq_div = round(note_freq * 2 ** 21 / self.clock_rate)  # 5 from sample length, 16 bit counter
-        if freq_div > 0xFFFF:
-            print('Freq 0x%06X exceeds the max value' % freq_div)
-            print('Required bit length ', freq_div.bit_length() - 16)
-            freq_div = 0xFFFF
-        return self.FreqDiv(voice, freq_div)
+        return self.FreqDiv(voice, self.Clamp(self.FreqDivider(note_freq)))
 
     def FreqDiv(self, voice, freq_div):
-        return self.Voice(voice, 2, freq_div)
+        return self.Emit(self.Voice(voice, 2, freq_div))
 
     def Wave(self, voice, wave_start, wave_end, wave_loop=-1, wave_bank=0):
         if wave_loop == -1:
             wave_loop = wave_start
-        out = self.Voice(voice, 4, wave_bank)
-        out += self.Voice(voice, 5, wave_start)
-        out += self.Voice(voice, 6, wave_end)
-        out += self.Voice(voice, 7, wave_loop)
-        return out
+        return self.Emit(self.Voice(voice, 4, wave_bank) +
+                         self.Voice(voice, 5, wave_start) +
+                         self.Voice(voice, 6, wave_end) +
+                         self.Voice(voice, 7, wave_loop))
 
 
 class C140(Chip):
-    def __init__(self, clock_rate=round((49152000 / 384) / 6)):
-        super().__init__()
+    freq_bits = 20
+
+    def __init__(self, clock_rate=round((49152000 / 384) / 6), writer=None):
+        super().__init__(writer)
         self.clock_rate = clock_rate
 
     def Params(self):
@@ -181,10 +417,7 @@ class C140(Chip):
 
         @staticmethod
         def FromSamples(samples):
-            sample_data = bytes()
-            for s in samples:
-                sample_data += s
-            return C140.DataBlock.FromBuffer(sample_data)
+            return C140.DataBlock.FromBuffer(b''.join(samples))
 
     @staticmethod
     def Write(address, value):
@@ -194,42 +427,72 @@ class C140(Chip):
     def Voice(voice_nr, offset, value):
         return C140.Write((voice_nr << 4) | offset, value)
 
-    @staticmethod
-    def Volume(voice, volume_left, volume_right=-1, gain=1/4):
+    def Volume(self, voice, volume_left, volume_right=-1, gain=1/4):
         if volume_right == -1:
             volume_right = volume_left
         volume_left = int(round(volume_left * gain))
         volume_right = int(round(volume_right * gain))
-        return C140.Voice(voice, 0, volume_right) + C140.Voice(voice, 1, volume_left)
+        return self.Emit(C140.Voice(voice, 0, volume_right) + C140.Voice(voice, 1, volume_left))
 
-    @staticmethod
-    def FreqDiv(voice, freq_div):
-        return C140.Voice(voice, 2, freq_div >> 8) + C140.Voice(voice, 3, freq_div & 0xFF)
+    def FreqDiv(self, voice, freq_div):
+        return self.Emit(C140.Voice(voice, 2, freq_div >> 8) + C140.Voice(voice, 3, freq_div & 0xFF))
 
     def FreqHz(self, voice, note_freq):
-        freq_div = round(note_freq * 2 ** 20 / self.clock_rate)  # 5 from sample length, 16 bit counter
-        if freq_div > 0xFFFF:
-            print('Freq 0x%06X exceeds the max value' % freq_div)
-            freq_div = 0xFFFF
-        return self.FreqDiv(voice, freq_div)
+        return self.FreqDiv(voice, self.Clamp(self.FreqDivider(note_freq)))
 
-    @staticmethod
-    def Wave(voice, wave_start, wave_end, wave_loop=-1, wave_bank=0):
+    def Wave(self, voice, wave_start, wave_end, wave_loop=-1, wave_bank=0):
         if wave_loop == -1:
             wave_loop = wave_start
-        out = C140.Voice(voice, 4, wave_bank)
-        out += C140.Voice(voice, 6, wave_start >> 8)
-        out += C140.Voice(voice, 7, wave_start & 0xFF)
-        out += C140.Voice(voice, 8, wave_end >> 8)
-        out += C140.Voice(voice, 9, wave_end & 0xFF)
-        out += C140.Voice(voice, 10, wave_loop >> 8)
-        out += C140.Voice(voice, 11, wave_loop & 0xFF)
-        return out
+        return self.Emit(b''.join([C140.Voice(voice, 4, wave_bank),
+                                   C140.Voice(voice, 6, wave_start >> 8),
+                                   C140.Voice(voice, 7, wave_start & 0xFF),
+                                   C140.Voice(voice, 8, wave_end >> 8),
+                                   C140.Voice(voice, 9, wave_end & 0xFF),
+                                   C140.Voice(voice, 10, wave_loop >> 8),
+                                   C140.Voice(voice, 11, wave_loop & 0xFF)]))
 
-    @staticmethod
-    def KeyOn(voice):
-        return C140.Voice(voice, 5, 0xD0)
+    def KeyOn(self, voice):
+        return self.Emit(C140.Voice(voice, 5, 0xD0))
 
-    @staticmethod
-    def KeyOff(voice):
-        return C140.Voice(voice, 5, 0x00)
+    def KeyOff(self, voice):
+        return self.Emit(C140.Voice(voice, 5, 0x00))
+
+
+class PitchTable:
+    """ frequency register value and order of the WSG register values played on a chip, worked out once and then
+    looked up. High pitch notes exceeding the chip's frequency range use a wave resampled to 2^(5 - order) samples, the
+    register value is clamped (an overflow) should the rounding still exceed 16 bits """
+    FreqDivider = Chip.FreqDivider
+
+    def __init__(self, chip):
+        # only the clock of the chip is kept, not its writer
+        self.freq_bits = chip.freq_bits
+        self.clock_rate = chip.clock_rate
+        self.pitches = {}
+
+    def Pitch(self, value, sample_rate, register_size):
+        """ (frequency register value, order, overflow) of a WSG frequency register value """
+        key = (value, sample_rate, register_size)
+        pitch = self.pitches.get(key)
+        if pitch is None:
+            note_freq = float(value) * sample_rate / (2 ** register_size)
+            order = max(self.FreqDivider(note_freq).bit_length() - 16, 0)
+            freq_div = self.FreqDivider(note_freq / (2 ** order))
+            pitch = self.pitches[key] = (min(freq_div, 0xFFFF), order, freq_div > 0xFFFF)
+        return pitch
+
+
+# pitch tables by chip type and clock, shared by all the songs converted
+pitch_tables = {}
+
+
+def GetPitchTable(chip):
+    key = (type(chip), chip.clock_rate)
+    table = pitch_tables.get(key)
+    if table is None:
+        table = pitch_tables[key] = PitchTable(chip)
+    return table
+
+
+# the chips a song can be converted for
+chips = {'c352': C352, 'c140': C140}
@@ -1,4 +1,114 @@
 import numpy as np
+import heapq
+from array import array
+
+# event type codes of the columnar event store
+NOTE, VALUE, WAVE, VOLUME, VOLUME_COMMAND, DURATION_MULTIPLIER, SAMPLE_RATE, FRAME_RATE, REGISTER_SIZE, WAVETABLE = \
+    range(10)
+
+
+def timestamp_max(tracks):
+    value = 0
+
+    for track in tracks:
+        track = Track.FromEvents(track)
+        for index in reversed(range(len(track))):
+            if track.code[index] == NOTE:
+                value = max(value, track.timestamp[index] + track.duration[index])
+                break
+    return value
+
+
+def note_boundary(tracks, start, length):
+    """ the first frame from start on, before start + length, that no note of the tracks plays through: the notes
+    there either start or have ended. None when every frame is inside a note """
+    sounding = bytearray(length)
+    for track in tracks:
+        for index in range(len(track)):
+            if track.code[index] == NOTE:
+                begin = max(track.timestamp[index] + 1, start)
+                end = min(track.timestamp[index] + track.duration[index], start + length)
+                if begin < end:
+                    sounding[begin - start:end - start] = b'\x01' * (end - begin)
+    index = sounding.find(0)
+    return None if index < 0 else start + index
+
+
+def tracks2rows(tracks):
+    """ the events of the tracks by frame: rows[timestamp][track] lists the (code, timestamp, value, duration) records
+    of that frame """
+
+    tracks = [Track.FromEvents(track) for track in tracks]
+    tmax = timestamp_max(tracks)
+    rows = [[[] for i in range(len(tracks))] for j in range(tmax)]
+
+    for num, track in enumerate(tracks):
+        for record in track.Records():
+            if record[1] < tmax:
+                rows[record[1]][num].append(record)
+
+    return rows
+
+
+def iter_rows(tracks):
+    """ the rows of tracks2rows generated one frame at a time, without allocating the whole grid up front """
+    return Timeline(tracks).Rows()
+
+
+class Timeline:
+    """ sparse alternative to tracks2rows: the events of all tracks merged into one stream sorted by frame and track,
+    frames without events are not visited. Further songs can be appended, their frames continue after the current end
+    while the timestamps of their records are kept """
+
+    def __init__(self, tracks):
+        self.channels = 0
+        self.length = 0
+        self.parts = []
+        self.loop = None  # (start, length) in frames of a loop found by the driver
+        self.Append(tracks)
+
+    def Append(self, tracks, gap=0):
+        """ play the tracks after the current end, gap empty frames in between """
+        tracks = [Track.FromEvents(track) for track in tracks]
+        start = self.length + gap if self.parts else 0
+        self.parts.append((start, tracks))
+        self.channels = max(self.channels, len(tracks))
+        self.length = start + timestamp_max(tracks)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        """ (frame, track nr, record) of each event before the end of its song, the events of a track keep their
+        order within a frame """
+        streams = []
+        for start, tracks in self.parts:
+            tmax = timestamp_max(tracks)
+            for num, track in enumerate(tracks):
+                streams.append(Timeline.Stream(start, num, track, tmax))
+
+        for frame, num, index, record in heapq.merge(*streams):
+            yield frame, num, record
+
+    @staticmethod
+    def Stream(start, num, track, tmax):
+        records = track.Records()
+        if any(track.timestamp[i] > track.timestamp[i + 1] for i in range(len(track) - 1)):
+            records = sorted(records, key=lambda record: record[1])
+        for index, record in enumerate(records):
+            if record[1] < tmax:
+                yield start + record[1], num, index, record
+
+    def Rows(self):
+        """ the dense rows of tracks2rows generated one frame at a time """
+        events = iter(self)
+        event = next(events, None)
+        for frame in range(self.length):
+            row = [[] for i in range(self.channels)]
+            while event is not None and event[0] == frame:
+                row[event[1]].append(event[2])
+                event = next(events, None)
+            yield row
 
 
 class Register:
@@ -17,29 +127,168 @@ class Register:
     def Generate(self, sample_length, oversampling=0):
         out = np.zeros(sample_length)
         shift_amount = self.size - self.wavetable_order + oversampling
-        max_value = np.uint32((2 ** self.size - 1) * (2 ** oversampling))
 
 #        volume_scale = self.volume / 15.0 / 7.5
         volume_scale = self.volume / 15.0
 
-        if self.value:
-            for i in range(sample_length):
-                self.accumulator += self.value
-                self.accumulator &= max_value
-                if self.volume:
-                    out[i] = self.wavetable[self.accumulator >> shift_amount]
+        if self.value and sample_length:
+            accumulator = self.Accumulate(sample_length, oversampling)
+            self.accumulator = np.uint32(accumulator[-1])
+            if self.volume:
+                out = np.asarray(self.wavetable)[accumulator >> shift_amount].astype(np.float64)
             out = ((out + 1) / 8 - 1) * volume_scale
 
         return out
 
+    def Accumulate(self, sample_length, oversampling=0):
+        """ accumulator values after each of the next sample_length steps, computed for the whole block at once.
+        The mask (2^size - 1) * 2^oversampling clears the low oversampling bits, so apart from the first step (the
+        accumulator may still carry low bits from a call with a different oversampling) each step adds the increment
+        with its low bits dropped, modulo 2^(size + oversampling) """
+        max_value = (2 ** self.size - 1) * (2 ** oversampling)
+        value = int(self.value) & 0xFFFFFFFF
+        first = ((int(self.accumulator) + value) & 0xFFFFFFFF) & max_value
+
+        steps = np.full(sample_length, (value >> oversampling) << oversampling, dtype=np.uint64)
+        steps[0] = first
+        accumulator = np.cumsum(steps, dtype=np.uint64)
+        accumulator &= np.uint64(max_value)
+        return accumulator.astype(np.uint32)
+
+
+class Track:
+    """ columnar store of the events of a track, what the drivers emit. Timestamp, type code and duration (notes only)
+    are kept in parallel integer arrays and the value in a list as a few events carry a float or an array (frame rate,
+    wavetable). The envelopes of volume commands are kept by index. Indexing and iterating give the event classes
+    below as a view, changes to these views are not written back """
+
+    def __init__(self):
+        self.timestamp = array('q')
+        self.code = array('b')
+        self.value = []
+        self.duration = array('q')
+        self.data = {}
+
+    @staticmethod
+    def FromEvents(events):
+        """ the events as a Track, a Track is returned as is """
+        if isinstance(events, Track):
+            return events
+        track = Track()
+        for event in events:
+            track.append(event)
+        return track
+
+    def Add(self, code, timestamp, value, duration=0, data=None):
+        if data is not None:
+            self.data[len(self.code)] = data
+        self.timestamp.append(timestamp)
+        self.code.append(code)
+        self.value.append(value)
+        self.duration.append(duration)
+
+    def Note(self, timestamp, value, duration):
+        self.Add(NOTE, timestamp, value, duration)
+
+    def Value(self, timestamp, value):
+        self.Add(VALUE, timestamp, value)
+
+    def Wave(self, timestamp, value):
+        self.Add(WAVE, timestamp, value)
+
+    def Volume(self, timestamp, value):
+        self.Add(VOLUME, timestamp, value)
+
+    def VolumeCommand(self, timestamp, value, envelope=None):
+        self.Add(VOLUME_COMMAND, timestamp, value, data=envelope)
+
+    def DurationMultiplier(self, timestamp, value):
+        self.Add(DURATION_MULTIPLIER, timestamp, value)
+
+    def SampleRate(self, timestamp, rate):
+        self.Add(SAMPLE_RATE, timestamp, rate)
+
+    def FrameRate(self, timestamp, frame_rate):
+        self.Add(FRAME_RATE, timestamp, frame_rate)
+
+    def RegisterSize(self, timestamp, size):
+        self.Add(REGISTER_SIZE, timestamp, size)
+
+    def Wavetable(self, timestamp, wavetable):
+        self.Add(WAVETABLE, timestamp, wavetable)
+
+    def Records(self):
+        """ (code, timestamp, value, duration) of each event """
+        return zip(self.code, self.timestamp, self.value, self.duration)
+
+    def Truncate(self, timestamp_max, extra=0):
+        """ drop the events past timestamp_max and shorten the last note to end there (extra frames later) """
+        for index in reversed(range(len(self))):
+            if self.timestamp[index] > timestamp_max:
+                self.pop()
+            elif self.code[index] == NOTE:
+                self.duration[index] = min(self.duration[index], timestamp_max - self.timestamp[index] + extra)
+                break
+
+    # list compatibility, the events are given and taken as event classes
+    def append(self, event):
+        self.Add(event.code, event.timestamp, getattr(event, event.field), getattr(event, 'duration', 0),
+                 getattr(event, 'envelope', None))
+
+    def extend(self, events):
+        if isinstance(events, Track):
+            offset = len(self.code)
+            self.timestamp.extend(events.timestamp)
+            self.code.extend(events.code)
+            self.value.extend(events.value)
+            self.duration.extend(events.duration)
+            for index, data in events.data.items():
+                self.data[offset + index] = data
+        else:
+            for event in events:
+                self.append(event)
+
+    def pop(self, index=-1):
+        event = self[index]
+        index %= len(self.code)
+        # keep the envelopes of the following events in place
+        self.data = {(i - 1 if i > index else i): data for i, data in self.data.items() if i != index}
+        del self.timestamp[index]
+        del self.code[index]
+        del self.value[index]
+        del self.duration[index]
+        return event
+
+    def __len__(self):
+        return len(self.code)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.code)))]
+        code = self.code[index]
+        index %= len(self.code)
+        if code == NOTE:
+            return Note(self.timestamp[index], self.value[index], self.duration[index])
+        elif code == VOLUME_COMMAND:
+            return VolumeCommand(self.timestamp[index], self.value[index], self.data.get(index, []))
+        return event_classes[code](self.timestamp[index], self.value[index])
+
+    def __iter__(self):
+        for index in range(len(self.code)):
+            yield self[index]
+
 
 class Event:
+    code = None
+    field = None
 
     def __init__(self, timestamp):
         self.timestamp = timestamp
 
 
 class Note(Event):
+    code = NOTE
+    field = 'value'
 
     def __init__(self, timestamp, value, duration):
         super().__init__(timestamp)
@@ -51,6 +300,8 @@ class Note(Event):
 
 
 class Value(Event):
+    code = VALUE
+    field = 'value'
 
     def __init__(self, timestamp, value):
         super().__init__(timestamp)
@@ -61,6 +312,8 @@ class Value(Event):
 
 
 class Wave(Event):
+    code = WAVE
+    field = 'wave'
 
     def __init__(self, timestamp, value):
         super().__init__(timestamp)
@@ -71,6 +324,8 @@ class Wave(Event):
 
 
 class Volume(Event):
+    code = VOLUME
+    field = 'volume'
 
     def __init__(self, timestamp, value):
         super().__init__(timestamp)
@@ -81,6 +336,8 @@ class Volume(Event):
 
 
 class VolumeCommand(Event):
+    code = VOLUME_COMMAND
+    field = 'volume_command'
 
     def __init__(self, timestamp, value, envelope=[]):
         super().__init__(timestamp)
@@ -92,6 +349,8 @@ class VolumeCommand(Event):
 
 
 class DurationMultiplier(Event):
+    code = DURATION_MULTIPLIER
+    field = 'duration_multiplier'
 
     def __init__(self, timestamp, value):
         super().__init__(timestamp)
@@ -102,6 +361,8 @@ class DurationMultiplier(Event):
 
 
 class SampleRate(Event):
+    code = SAMPLE_RATE
+    field = 'rate'
 
     def __init__(self, timestamp, rate):
         super().__init__(timestamp)
@@ -112,6 +373,8 @@ class SampleRate(Event):
 
 
 class FrameRate(Event):
+    code = FRAME_RATE
+    field = 'frame_rate'
 
     def __init__(self, timestamp, frame_rate):
         super().__init__(timestamp)
@@ -122,6 +385,8 @@ class FrameRate(Event):
 
 
 class RegisterSize(Event):
+    code = REGISTER_SIZE
+    field = 'size'
 
     def __init__(self, timestamp, size):
         super().__init__(timestamp)
@@ -132,6 +397,8 @@ class RegisterSize(Event):
 
 
 class Wavetable(Event):
+    code = WAVETABLE
+    field = 'wavetable'
 
     def __init__(self, timestamp, wavetable):
         super().__init__(timestamp)
@@ -139,3 +406,7 @@ class Wavetable(Event):
 
     def __repr__(self):
         return "<dt %d wavetable>" % (self.timestamp)
+
+
+event_classes = [Note, Value, Wave, Volume, VolumeCommand, DurationMultiplier, SampleRate, FrameRate, RegisterSize,
+                 Wavetable]
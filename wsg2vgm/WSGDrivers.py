@@ -1,7 +1,14 @@
 import numpy as np
 import WSG
+import WSGSequencer
+import WSGProfile
 import zipfile
 import json
+import os
+import hashlib
+import collections
+import importlib
+import math
 
 
 def uint16_l(data, offset):
@@ -12,29 +19,196 @@ def uint16_b(data, offset):
     return int.from_bytes(data[offset:offset + 2], byteorder='big')
 
 
+def superpacm_envelope(rom, attack_addr, attack_len, sustain_len, decay_len, duration):
+    """ (tick, volume) change points of a Super Pacman note: the attack envelope, then the volume 0xC for the sustain
+    and going down by one each frame of the decay, held after that. A note starts at 0xC, which it keeps without any
+    of them """
+    points = []
+    volume = 0xC
+    for tick in range(min(attack_len, duration)):
+        volume = rom[attack_addr + tick + 1]
+        points.append((tick, volume))
+    if sustain_len and attack_len < duration:
+        volume = 0xC
+        points.append((attack_len, volume))
+    for tick in range(attack_len + sustain_len, min(attack_len + sustain_len + decay_len, duration)):
+        volume -= 1
+        points.append((tick, volume))
+    if not points and duration:
+        points.append((0, volume))
+    return points
+
+
+class RomCache:
+    """ assembled ROM images and wavetables keyed by the content hash of the zip they come from and the layout of the
+    files taken from it. Up to max_entries are kept in memory, the least recently used ones are evicted first. With a
+    path set, the entries are also stored on disk and survive the process """
+
+    def __init__(self, max_entries=32, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.zip_hashes = {}
+
+    def zip_hash(self, filename):
+        """ content hash of a zip, only recalculated when the file changes """
+        stat = os.stat(filename)
+        file_id = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self.zip_hashes:
+            sha = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b''):
+                    sha.update(chunk)
+            self.zip_hashes[file_id] = sha.hexdigest()
+        return self.zip_hashes[file_id]
+
+    def key(self, filename, layout):
+        layout = json.dumps(layout, sort_keys=True)
+        return hashlib.sha1((self.zip_hash(filename) + layout).encode('utf-8')).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.npy')
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        elif self.path and os.path.exists(self.filename(key)):
+            data = np.load(self.filename(key))
+            self.put(key, data, store=False)
+        return data
+
+    def put(self, key, data, store=True):
+        data.flags.writeable = False  # shared by all the readers of the game
+        self.entries[key] = data
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if store and self.path:
+            os.makedirs(self.path, exist_ok=True)
+            np.save(self.filename(key), data)
+
+    def evict(self, key=None, disk=False):
+        """ drop one entry or, without a key, all of them. With disk set the stored copies are removed as well """
+        keys = [key] if key else list(self.entries)
+        if disk and self.path and os.path.isdir(self.path):
+            keys = set(keys)
+            if not key:
+                keys.update(os.path.splitext(f)[0] for f in os.listdir(self.path) if f.endswith('.npy'))
+            for k in keys:
+                if os.path.exists(self.filename(k)):
+                    os.remove(self.filename(k))
+        for k in keys:
+            self.entries.pop(k, None)
+
+
+class Driver:
+    """ a sound driver and its capabilities. The song reader is either the name of a Reader method or given as
+    'module:function' and imported on first use, it is called as reader(file_reader, song_nr) and returns the tracks """
+
+    def __init__(self, name, reader, description='', voices=8, wavetable='rom_file', loop_end=False):
+        self.name = name
+        self.reader = reader
+        self.description = description
+        self.voices = voices  # number of voices the driver sequences
+        self.wavetable = wavetable  # 'rom_file': separate wavetable PROM, 'rom': part of the sound program ROM
+        self.loop_end = loop_end  # songs are cut at the json loop_end
+        self.function = None
+
+    def load(self):
+        if self.function is None:
+            if ':' in self.reader:
+                module_name, function_name = self.reader.split(':')
+                self.function = getattr(importlib.import_module(module_name), function_name)
+            else:
+                self.function = getattr(Reader, self.reader)
+        return self.function
+
+
+drivers = {}
+
+
+def register_driver(name, reader, description='', **capabilities):
+    """ add a driver to the registry, the json configs select it by name in their 'driver' field """
+    drivers[name] = Driver(name, reader, description, **capabilities)
+    return drivers[name]
+
+
+def get_driver(name):
+    """ registered driver, an unregistered 'module:function' name is registered on the fly so that ROM variants with
+    their own reader only need a config """
+    driver = drivers.get(name)
+    if driver is None:
+        if ':' not in name:
+            raise Exception('Unknown driver %s!' % name)
+        driver = register_driver(name, name)
+    return driver
+
+
+register_driver('ponpoko', 'read_ponpoko', 'Ponpoko, Z80 driven 3 voice WSG', voices=3)
+register_driver('superpacm', 'read_superpacm', 'Super Pacman')
+register_driver('pacnpal', 'read_superpacm', 'Pac & Pal, same as Super Pacman')
+register_driver('phozon', 'read_phozon', 'Phozon')
+register_driver('grobda', 'read_grobda', 'Grobda and Libble Rabble')
+register_driver('mappy', 'read_mappy', 'Mappy')
+register_driver('todruaga', 'read_todruaga', 'Tower of Druaga, Dig Dug II, Motos and Toypop', loop_end=True)
+register_driver('skykid', 'read_skykid', 'Sky Kid, Dragon Buster, Metro-Cross, Pac-Land and Baraduke',
+                wavetable='rom')
+
+
 class Reader:
+    loop_end_max = 60 * 60 * 2  # 2 minutes max
+    rom_cache = RomCache()
+    flat_path = None  # directory with flat ROM images and wavetables, memory mapped instead of reading the zips
+
+    @staticmethod
+    def prom_key(game, rom_path):
+        """ RomCache key of the game's ROM image, the zip and the files assembled from it """
+        layout = [[rom_file['offset'], rom_file['filename']] for rom_file in game['rom_files']]
+        return Reader.rom_cache.key(rom_path + game['rom_filename'], layout)
+
+    @staticmethod
+    def wavetable_key(game, rom_path):
+        return Reader.rom_cache.key(rom_path + game['rom_filename'], ['wavetable', game['wavetable_filename']])
 
     @staticmethod
     def get_prom(game, rom_path):
         """ get the game's ROM data from a rom file containing partial data blocks """
+        zip_filename = rom_path + game['rom_filename']
+        key = Reader.prom_key(game, rom_path)
+        rom = Reader.rom_cache.get(key)
+        if rom is not None:
+            return rom
+
         rom_data = bytearray(2 ** 16)  # 64K
-        for rom_file in game['rom_files']:
-            offset = int(rom_file['offset'], 0)
-            filename = rom_file['filename']
-            with zipfile.ZipFile(rom_path + game['rom_filename']) as zipf:
+        with zipfile.ZipFile(zip_filename) as zipf:
+            for rom_file in game['rom_files']:
+                offset = int(rom_file['offset'], 0)
+                filename = rom_file['filename']
                 with zipf.open(filename) as f:
                     data = f.read()
-            rom_data[offset:offset + len(data)] = data
+                rom_data[offset:offset + len(data)] = data
 
-        return np.frombuffer(rom_data, dtype=np.uint8)
+        rom = np.frombuffer(rom_data, dtype=np.uint8)
+        Reader.rom_cache.put(key, rom)
+        return rom
 
     @staticmethod
     def get_wavetable(game, rom_path):
         """ sample data from a rom file """
-        with zipfile.ZipFile(rom_path + game['rom_filename']) as zipf:
+        zip_filename = rom_path + game['rom_filename']
+        key = Reader.wavetable_key(game, rom_path)
+        wavetable = Reader.rom_cache.get(key)
+        if wavetable is not None:
+            return wavetable
+
+        with zipfile.ZipFile(zip_filename) as zipf:
             with zipf.open(game['wavetable_filename']) as f:
                 wt = np.frombuffer(f.read(), np.uint8)
-                return np.reshape(wt, (8, 32))
+                wavetable = np.reshape(wt, (8, 32))
+
+        Reader.rom_cache.put(key, wavetable)
+        return wavetable
 
     def get_game_info(self, game):
         """ driver addresses """
@@ -53,12 +227,48 @@ class Reader:
         self.attack = int(game.get('attack', '0'), 0)
         self.attack_env = int(game.get('attack_env', '0'), 0)
         self.dur_multiplier = int(game.get('dur_multiplier', '0'), 0)
+        self.driver_name = game.get('driver', self.driver_name)
+        self.track_entry_size = game.get('track_entry_size', 6)
+        self.song_length_max = {int(song_nr): length for song_nr, length in game.get('song_length_max', {}).items()}
 
     def __init__(self, game_name):
         self.game_name = game_name
-        self.loop_end = 60 * 60 * 2  # 2 minutes max
+        self.driver_name = game_name
+        self.loop_end = Reader.loop_end_max
+        self.total_songs = 0
+        self.rom_path = ''
+        self.game_info = {}
+        self.songs_info = []
+        self.rom = None
+        self.wavetable = None
+        self.loaded = False
+        self.sequencers = {}
+        self.pitch_tables = {}
+        self.pitch_lookups = {}
+        self.loop = None  # (start, length) in frames of the loop found in the last song read
 
-    def read(self, song_nr):
+    @staticmethod
+    def game_names():
+        """ all games with a config, either in games_info.json or in their own json file """
+        names = []
+        for filename in sorted(os.listdir('json')):
+            name, ext = os.path.splitext(filename)
+            if ext == '.json' and name != 'games_info':
+                names.append(name)
+        try:
+            with open('json/games_info.json') as infile:
+                games_info = json.loads(infile.read())
+                for item in games_info['games']:
+                    if item['game_name'] not in names:
+                        names.append(item['game_name'])
+        except IOError:
+            pass
+        return names
+
+    def load(self, rom=None, wavetable=None):
+        """ read the game's config, ROM image and wavetable, done once for all the songs of the game. An already
+        decoded rom and wavetable (e.g. shared with a worker process) can be passed to skip reading the ROM files """
+        stage = WSGProfile.begin(WSGProfile.ROM_LOAD)
         try:
             with open('json/games_info.json') as infile:
                 games_info = json.loads(infile.read())
@@ -66,43 +276,125 @@ class Reader:
                 game = next((item for item in games_info['games'] if item['game_name'] == self.game_name), None)
                 if game:
                     self.get_game_info(game)
-                    self.rom = Reader.get_prom(game, self.rom_path)
-                    if game.get('wavetable_filename'):
-                        self.wavetable = Reader.get_wavetable(game, self.rom_path)
+                    self.load_rom(game, rom, wavetable)
 
             with open('json/' + self.game_name + '.json') as f:
                 data = json.loads(f.read())
                 rom_info = data.get('rom_info')
                 if rom_info:
                     self.get_game_info(rom_info)
-                    self.rom = Reader.get_prom(rom_info, self.rom_path)
-                    self.wavetable = Reader.get_wavetable(rom_info, self.rom_path)
-                songs = data.get('songs')
-                if songs and song_nr < len(songs):
-                    self.loop_end = songs[song_nr].get('loop_end', self.loop_end)
+                    self.load_rom(rom_info, rom, wavetable)
+                self.game_info = data.get('game_info', {})
+                self.songs_info = data.get('songs', [])
 
         except IOError:
             pass
 
+        self.loaded = True
+        WSGProfile.end(stage)
+
+    def load_rom(self, game, rom=None, wavetable=None):
+        self.pitch_tables = {}
+        self.pitch_lookups = {}
+        if rom is None and Reader.flat_path:
+            rom, wavetable = self.load_flat(game)
+        self.rom = rom if rom is not None else Reader.get_prom(game, self.rom_path)
+        if wavetable is not None:
+            self.wavetable = wavetable
+        elif game.get('wavetable_filename'):
+            self.wavetable = Reader.get_wavetable(game, self.rom_path)
+
+    def flat_filename(self, key, extension):
+        """ flat image of the game named after its RomCache key, a changed zip or a different layout of the files taken
+        from it (e.g. a game configured in both games_info.json and its own json) gets an image of its own """
+        return os.path.join(Reader.flat_path, '%s-%s%s' % (self.game_name, key, extension))
+
+    def load_flat(self, game):
+        """ memory map the flat ROM image and wavetable of the game, they are assembled from the zip and exported on
+        first use. The files are plain 64K and 8x32 byte images """
+        rom_filename = self.flat_filename(Reader.prom_key(game, self.rom_path), '.rom')
+        if not os.path.exists(rom_filename):
+            Reader.export_flat(rom_filename, Reader.get_prom(game, self.rom_path))
+        rom = np.memmap(rom_filename, dtype=np.uint8, mode='r')
+
+        wavetable = None
+        if game.get('wavetable_filename'):
+            wavetable_filename = self.flat_filename(Reader.wavetable_key(game, self.rom_path), '.wavetable')
+            if not os.path.exists(wavetable_filename):
+                Reader.export_flat(wavetable_filename, Reader.get_wavetable(game, self.rom_path))
+            wavetable = np.memmap(wavetable_filename, dtype=np.uint8, mode='r', shape=(8, 32))
+
+        return rom, wavetable
+
+    @staticmethod
+    def export_flat(filename, data):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        # written aside and renamed so that other processes never map a partial file
+        data.tofile(filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+
+    def sequencer(self, track_class):
+        """ sequence interpreter for the driver's track class, kept for all the songs of the game so that decoded
+        instructions are shared between songs """
+        sequencer = self.sequencers.get(track_class)
+        if sequencer is None or sequencer.source is not self.rom:
+            sequencer = WSGSequencer.Sequencer(self.rom, track_class.commands)
+            self.sequencers[track_class] = sequencer
+        return sequencer
+
+    def pitch_table(self, addr, width):
+        """ register values of the note table at addr, big endian values of width bytes, for every note (the note
+        nibble plus a transpose of up to 15), fine tune (the value raised by fine_tune / 256) and octave (the value
+        shifted right). A numpy array indexed [note, fine tune, octave], built once for the game """
+        table = self.pitch_tables.get((addr, width))
+        if table is None:
+            rom = self.rom
+            values = np.array([int.from_bytes(rom[addr + note * width:addr + (note + 1) * width], byteorder='big')
+                               for note in range(31)], dtype=np.int64)
+            values = values[:, np.newaxis] + np.arange(16) * (values[:, np.newaxis] >> 8)
+            table = values[:, :, np.newaxis] >> np.arange(16)
+            self.pitch_tables[(addr, width)] = table
+        return table
+
+    def note_pitches(self, addr, width, transpose=0, fine_tune=0):
+        """ register values of the note opcodes (note nibble << 4 | octave) of a track as a list, so that the drivers
+        look a note up by its opcode """
+        key = (addr, width, transpose, fine_tune)
+        pitches = self.pitch_lookups.get(key)
+        if pitches is None:
+            table = self.pitch_table(addr, width)
+            pitches = table[transpose:transpose + 16, fine_tune].reshape(256).tolist()
+            self.pitch_lookups[key] = pitches
+        return pitches
+
+    def song_info(self, song_nr):
+        """ song entry of the game's json file, empty if there is none """
+        if not self.loaded:
+            self.load()
+        if 0 <= song_nr < len(self.songs_info):
+            return self.songs_info[song_nr]
+        return {}
+
+    def read(self, song_nr):
+        if not self.loaded:
+            self.load()
+
+        self.loop_end = self.song_info(song_nr).get('loop_end', Reader.loop_end_max)
+        self.loop = None
+
         if song_nr >= self.total_songs:
             raise Exception('Song nr exceeds the total!')
 
-        if self.game_name == 'ponpoko':
-            return self.read_ponpoko(song_nr)
-        elif self.game_name in ('superpacm', 'pacnpal'):
-            return self.read_superpacm(song_nr)
-        elif self.game_name == 'phozon':
-            return self.read_phozon(song_nr)
-        elif self.game_name in ('grobda', 'liblrabl'):
-            return self.read_grobda(song_nr)
-        elif self.game_name == 'mappy':
-            return self.read_mappy(song_nr)
-        elif self.game_name in ('todruaga', 'digdug2', 'motos', 'toypop'):
-            return self.read_todruaga(song_nr)
-        elif self.game_name in ('skykid', 'drgnbstr', 'metrocrs', 'pacland', 'baraduke'):
-            return self.read_skykid(song_nr)
-        else:
-            raise Exception('Wrong game name!')
+        with WSGProfile.stage(WSGProfile.PARSE):
+            tracks = self.driver().load()(self, song_nr)
+            WSGProfile.count(WSGProfile.PARSE, sum(len(track) for track in tracks))
+        return tracks
+
+    def driver(self):
+        """ the driver selected by the game's config """
+        if not self.loaded:
+            self.load()
+        return get_driver(self.driver_name)
 
     def read_ponpoko(self, song_nr):
         """ Ponpoko is using the original 3OSC WSG driven by Z80. The game features 12 tunes which comprise both
@@ -126,22 +418,20 @@ class Reader:
 
         for i in range(3):
             timestamp = 0
-            track = []
+            track = WSG.Track()
             volume = -1
-            freq = 0
-            prev_note = []
             track_addr = uint16_l(self.rom, song_addr + i * 2)
 
             if i == 0:
-                track.append(WSG.Wavetable(timestamp, self.wavetable))
-                track.append(WSG.SampleRate(timestamp, 96000))  # 96 kHz
-                track.append(WSG.FrameRate(timestamp, 18432000 / 3 / (384 * 264)))  # 60.6... Hz
-                track.append(WSG.RegisterSize(timestamp, 20))
+                track.Wavetable(timestamp, self.wavetable)
+                track.SampleRate(timestamp, 96000)  # 96 kHz
+                track.FrameRate(timestamp, 18432000 / 3 / (384 * 264))  # 60.6... Hz
+                track.RegisterSize(timestamp, 20)
             else:
-                track.append(WSG.RegisterSize(timestamp, 16))
+                track.RegisterSize(timestamp, 16)
 
             # wave number
-            track.append(WSG.Wave(timestamp, self.rom[wave_addr + i]))
+            track.Wave(timestamp, self.rom[wave_addr + i])
 
             while True:
                 if self.rom[track_addr] == 0xFF:
@@ -150,7 +440,7 @@ class Reader:
                 # volume
                 if volume != self.rom[track_addr + 1]:
                     volume = self.rom[track_addr + 1]
-                    track.append(WSG.Volume(timestamp, volume))
+                    track.Volume(timestamp, volume)
 
                 #note
                 duration = self.rom[track_addr]
@@ -158,15 +448,7 @@ class Reader:
                 for num in range(2, event_length[i]):
                     val += self.rom[track_addr + num] << ((num - 2)*4)
 
-                track.append(WSG.Note(timestamp, val, duration))
-                # if val != 0:
-                #     if val != freq:
-                #         freq = val
-                #         track.append(WSG.Note(timestamp, freq, duration))
-                #         prev_note = track[-1]
-                #     else:
-                #         prev_note.duration += duration
-                #         print('!')
+                track.Note(timestamp, val, duration)
 
                 timestamp += duration
                 track_addr += event_length[i]
@@ -189,12 +471,12 @@ class Reader:
             track_addr.append(int.from_bytes(rom[offset:offset + 2], byteorder='big'))
 
         for num, start_addr in enumerate(track_addr):
-            track = []
+            track = WSG.Track()
             timestamp = 0
             track_off = song_off + num
             scale_nr = rom[self.note_tuning + track_off]
             offset = self.notes + scale_nr * 2
-            note_addr = int.from_bytes(rom[offset:offset + 2], byteorder='big')
+            pitches = self.note_pitches(int.from_bytes(rom[offset:offset + 2], byteorder='big'), 4)
             wave_nr = rom[self.waves + track_off] >> 4
             sustain_len = rom[self.sustain + track_off]
             decay_len = rom[self.decay + track_off]
@@ -202,56 +484,39 @@ class Reader:
             offset = self.attack_env + attack_len * 2
             attack_addr = int.from_bytes(rom[offset:offset + 2], byteorder='big')
             attack_len <<= 2
-            current_volume = 0
-            prev_volume = current_volume
-            note_duration = 0
-            current_note = 0
-            attack_cnt = 0
-            sustain_cnt = 0
-            decay_cnt = 0
+            prev_volume = 0
 
             if num == 0:
-                track.append(WSG.Wavetable(timestamp, self.wavetable))
-                track.append(WSG.SampleRate(0, 24000))
-                track.append(WSG.FrameRate(0, 18432000 / 3 / (384 * 264)))
-            track.append(WSG.RegisterSize(0, 20))
-            track.append(WSG.Wave(timestamp, wave_nr))
-
-            while rom[start_addr] != 0xFF or note_duration:
-                if note_duration == 0:
-                    # get a register value from the note lookup
-                    offset = note_addr + (rom[start_addr] >> 4) * 4
-                    current_note = int.from_bytes(rom[offset:offset + 4], byteorder='big')
-                    # apply octave divider
-                    current_note >>= (rom[start_addr] & 0xF)
-                    current_volume = 0xC
-                    note_duration = rom[start_addr + 1]
-                    track.append(WSG.Note(timestamp, current_note, note_duration))
-                    start_addr += 2
-                    attack_cnt = 0
-                    decay_cnt = 0
-                    sustain_cnt = 0
-                else:
-                    if attack_cnt < attack_len:
-                        attack_cnt += 1
-                        current_volume = rom[attack_addr + attack_cnt]
-                    elif sustain_cnt < sustain_len:
-                        if sustain_cnt == 0:
-                            current_volume = 0xC
-                        sustain_cnt += 1
-                    elif decay_cnt < decay_len:
-                        decay_cnt += 1
-                        current_volume -= 1
-
-                    if not current_note:
-                        current_volume = 0
+                track.Wavetable(timestamp, self.wavetable)
+                track.SampleRate(0, 24000)
+                track.FrameRate(0, 18432000 / 3 / (384 * 264))
+            track.RegisterSize(0, 20)
+            track.Wave(timestamp, wave_nr)
+
+            # the volume of a note only depends on its duration and whether it is a rest, the changes are worked out
+            # once and a note costs one step per change instead of one per frame
+            envelopes = {}
+            while rom[start_addr] != 0xFF:
+                # register value of the note in its octave
+                current_note = pitches[rom[start_addr]]
+                note_duration = rom[start_addr + 1]
+                track.Note(timestamp, current_note, note_duration)
+                start_addr += 2
+
+                points = envelopes.get((note_duration, current_note == 0))
+                if points is None:
+                    if current_note:
+                        points = superpacm_envelope(rom, attack_addr, attack_len, sustain_len, decay_len,
+                                                    note_duration)
+                    else:
+                        points = [(0, 0)] if note_duration else []
+                    envelopes[(note_duration, current_note == 0)] = points
 
+                for tick, current_volume in points:
                     if prev_volume != current_volume:
-                        track.append(WSG.Volume(timestamp, current_volume))
+                        track.Volume(timestamp + tick, current_volume)
                         prev_volume = current_volume
-
-                    note_duration -= 1
-                    timestamp += 1
+                timestamp += note_duration
 
             tracks.append(track)
 
@@ -267,6 +532,7 @@ class Reader:
         event_addr = []
         tracks = []
         timestamp_max = float('inf')
+        pitches = self.note_pitches(self.notes, 4)
 
         for i in range(track_nr[song_nr]):
             offset = self.songs + (track_offset[song_nr] + i) * 2
@@ -275,26 +541,23 @@ class Reader:
         for num, start_addr in enumerate(event_addr):
             # wave and volume
             timestamp = 0
-            track = []
+            track = WSG.Track()
             track_volume = 0x0F
             wave_nr = rom[self.waves + track_offset[song_nr] + num] >> 4
             if num == 0:
-                track.append(WSG.Wavetable(timestamp, self.wavetable))
-                track.append(WSG.SampleRate(0, 24000))
-                track.append(WSG.FrameRate(0, 18432000 / 3 / (384 * 264)))
+                track.Wavetable(timestamp, self.wavetable)
+                track.SampleRate(0, 24000)
+                track.FrameRate(0, 18432000 / 3 / (384 * 264))
 
-            track.append(WSG.RegisterSize(0, 20))
-            track.append(WSG.Wave(timestamp, wave_nr))
-            track.append(WSG.Volume(timestamp, track_volume))
+            track.RegisterSize(0, 20)
+            track.Wave(timestamp, wave_nr)
+            track.Volume(timestamp, track_volume)
 
             while rom[start_addr] != 0xFF:
-                # get a register value from the note lookup
-                offset = self.notes + (rom[start_addr] >> 4) * 4
-                value = int.from_bytes(rom[offset:offset + 4], byteorder='big')
-                # apply octave divider
-                value >>= (rom[start_addr] & 0xF)
+                # register value of the note in its octave
+                value = pitches[rom[start_addr]]
                 note_duration = rom[start_addr + 1]
-                track.append(WSG.Note(timestamp, value, note_duration))
+                track.Note(timestamp, value, note_duration)
                 timestamp += note_duration
                 start_addr += 2
 
@@ -304,17 +567,13 @@ class Reader:
         # adjust the final length
         # any track finishing first terminates the song so track lengths need to be adjusted
         for track in tracks:
-            for event in reversed(track):
-                if event.timestamp > timestamp_max:
-                    track.pop()
-                elif event.__class__.__name__ == 'Note':
-                    event.duration = min(event.duration, timestamp_max - event.timestamp + 1)
-                    break
+            track.Truncate(timestamp_max, 1)
 
         return tracks
 
     def read_grobda(self, song_nr):
-        rom = self.rom
+        sequencer = self.sequencer(GrobdaTrack)
+        rom = sequencer.rom
 
         offset = self.songs + song_nr * 2
         track_addr = uint16_b(rom, offset)
@@ -330,135 +589,41 @@ class Reader:
             track_addr += 3
 
         for num, start_addr in enumerate(event_addr):
-            track = []
-            repeats = 0
-            nonrepeats = 0
-            nonrepeats_2 = 0
-            timestamp = 0
+            track = WSG.Track()
             if num == 0:
-                track.append(WSG.Wavetable(timestamp, self.wavetable))
-                track.append(WSG.SampleRate(0, 24000))
-                track.append(WSG.FrameRate(0, 18432000 / 3 / (384 * 264)))
-
-            track.append(WSG.RegisterSize(0, 20))
-            track.append(WSG.Volume(timestamp, 0xF))
-            track.append(WSG.Wave(timestamp, rom[start_addr] >> 4))
-            track.append(WSG.VolumeCommand(timestamp, rom[start_addr + 1]))
-            vol_addr = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
-            duration_multiplier = rom[self.dur_multiplier + song_nr]
-            start_addr += 2
-            duration = 0
-            prev_volume = 0
-            current_volume = 0
-            vol_index = 0
-            ignore_env = 0
-            ignore_jump = 0
-
-            while True:
-                if duration == 0:
-                    if rom[start_addr] == 0xF0:
-                        break
-                    elif rom[start_addr] == 0xF1:
-                        # wave
-                        track.append(WSG.Wave(timestamp, rom[start_addr + 1] >> 4))
-                        start_addr += 2
-                    elif rom[start_addr] == 0xF2:
-                        # volume command
-                        track.append(WSG.VolumeCommand(timestamp, rom[start_addr + 1]))
-                        vol_addr = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
-                        ignore_env = 0
-                        start_addr += 2
-                    elif rom[start_addr] == 0xF3:
-                        # conditional jump nr of times
-                        repeats += 1
-                        if rom[start_addr + 1] <= repeats or ignore_jump:
-                            repeats = 0
-                            start_addr += 4
-                        else:
-                            start_addr = uint16_b(rom, start_addr + 2)
-                    elif rom[start_addr] == 0xF4:
-                        # ignore conditional jump F3
-                        ignore_jump = 1
-                        start_addr += 2
-                    elif rom[start_addr] == 0xF5:
-                        # conditional jump after x times
-                        nonrepeats += 1
-                        if rom[start_addr + 1] == nonrepeats:
-                            start_addr = uint16_b(rom, start_addr + 2)
-                            nonrepeats = 0
-                        else:
-                            start_addr += 4
-                    elif rom[start_addr] == 0xF6:
-                        # conditional jump
-                        nonrepeats_2 += 1
-                        if rom[start_addr + 1] == nonrepeats_2:
-                            start_addr = uint16_b(rom, start_addr + 2)
-                            nonrepeats_2 = 0
-                        else:
-                            start_addr += 4
-                    elif rom[start_addr] == 0xF7:
-                        # unconditional jump
-                        start_addr = uint16_b(rom, start_addr + 1)
-                    elif rom[start_addr] >= 0xF0:
-                        raise Exception('Unrecognised command %02X' % (rom[start_addr]))
-                    else:
-                        # get a register value from the note lookup
-                        current_note = 0
-                        if rom[start_addr] >> 4 != 0xC:
-                            offset = note_addr[num] + (rom[start_addr] >> 4) * 3
-                            current_note = int.from_bytes(rom[offset:offset + 3], byteorder='big')
-                            # apply octave divider
-                            current_note >>= (rom[start_addr] & 0xF)
-                        duration = int(rom[start_addr + 1]) * duration_multiplier
-                        track.append(WSG.Note(timestamp, current_note, duration))
-                        if ignore_env == 0:
-                            vol_index = vol_addr
-                        start_addr += 2
-                else:
-                    # volume processing for each channel
-                    value = rom[vol_index]
-                    if value < 0x10:
-                        current_volume = value
-                        vol_index += 1
-                    elif value == 0x12:
-                        if current_volume >= duration:
-                            current_volume = duration - 1
-                    elif value == 0x14:
-                        vol_index = vol_addr
-                        current_volume = rom[vol_index]
-                        vol_index += 1
-                    elif value == 0x16:
-                        if current_volume > rom[vol_index + 1]:
-                            current_volume -= 1
-                        else:
-                            current_volume = rom[vol_index + 1]
-                            vol_index += 2
-                    else:
-                        if value != 0x10:
-                            raise Exception('Unsupported volume command %02X' % value)
-
-                    if prev_volume != current_volume:
-                        track.append(WSG.Volume(timestamp, current_volume))
-                        prev_volume = current_volume
-
-                    timestamp += 1
-                    duration -= 1
+                track.Wavetable(0, self.wavetable)
+                track.SampleRate(0, 24000)
+                track.FrameRate(0, 18432000 / 3 / (384 * 264))
+
+            track.RegisterSize(0, 20)
+            track.Volume(0, 0xF)
+            track.Wave(0, rom[start_addr] >> 4)
+            track.VolumeCommand(0, rom[start_addr + 1])
+
+            state = GrobdaTrack(rom, start_addr + 2, track)
+            state.envelopes = sequencer.envelopes
+            state.volumes = self.volumes
+            state.pitches = self.note_pitches(note_addr[num], 3)
+            state.vol_addr = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
+            state.duration_multiplier = rom[self.dur_multiplier + song_nr]
+            sequencer.run(state)
 
             tracks.append(track)
 
         return tracks
 
     def read_mappy(self, song_nr):
-        rom = self.rom
+        sequencer = self.sequencer(MappyTrack)
+        rom = sequencer.rom
 
         offset = self.songs + song_nr * 2
         patt_addr = uint16_b(rom, offset)
         duration_multiplier = rom[self.dur_multiplier + song_nr]
 
-        note_addr = []
-        vol_addr = []
         tracks = []
         timestamp = []
+        # the volume is carried over from one track entry to the next
+        current_volume = 0
 
         while rom[patt_addr] != 0x11:
             track_addr = uint16_b(rom, patt_addr)
@@ -470,97 +635,34 @@ class Reader:
             if len(timestamp):
                 patt_timestamp = max(timestamp)
             while rom[track_addr] != 0x11:
-                track = []
-                current_note = 0
+                track = WSG.Track()
                 start_addr = uint16_b(rom, track_addr)
                 # initialise the timestamp variable
                 if len(tracks) == 0:
-                    track.append(WSG.Wavetable(0, self.wavetable))
-                    track.append(WSG.SampleRate(0, 24000))
-                    track.append(WSG.FrameRate(0, 18432000 / 3 / (384 * 264)))
+                    track.Wavetable(0, self.wavetable)
+                    track.SampleRate(0, 24000)
+                    track.FrameRate(0, 18432000 / 3 / (384 * 264))
 
                 if len(tracks) <= track_id:
                     timestamp.append(patt_timestamp)
-                    note_addr.append(uint16_b(rom, self.notes + rom[track_addr + 2] * 2))
-                    vol_addr.append(uint16_b(rom, self.volumes + rom[start_addr + 1] * 2))
-                    track.append(WSG.RegisterSize(0, 20))
-
-                note_addr[track_id] = uint16_b(rom, self.notes + rom[track_addr + 2] * 2)
-                vol_addr[track_id] = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
-
-                track.append(WSG.Wave(timestamp[track_id], rom[start_addr] >> 4))
-                track.append(WSG.VolumeCommand(timestamp[track_id], rom[start_addr + 1]))
-
-                start_addr += 2
-
-                prev_volume = 0
-                duration = 0
-                fx_counter = 0
-
-                while True:
-                    if duration == 0:
-                        if rom[start_addr] == 0xF0:
-                            # note tuning
-                            note_addr[track_id] = uint16_b(rom, self.notes + rom[start_addr + 1] * 2)
-                        elif rom[start_addr] == 0xF1:
-                            # wave nr
-                            track.append(WSG.Wave(timestamp[track_id], rom[start_addr + 1] >> 4))
-                        elif rom[start_addr] == 0xF2:
-                            # volume command
-                            track.append(WSG.VolumeCommand(timestamp[track_id], rom[start_addr + 1]))
-                            vol_addr[track_id] = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
-                        elif rom[start_addr] == 0xF3:
-                            # end of track
-                            break
-                        elif rom[start_addr] >= 0xF0:
-                            raise Exception('Unrecognised command %02X' % (rom[start_addr]))
-                        else:
-                            # get a register value from the note lookup
-                            offset = note_addr[track_id] + (rom[start_addr] >> 4) * 4
-                            value = int.from_bytes(rom[offset:offset + 4], byteorder='big')
-                            # apply octave divider
-                            value >>= (rom[start_addr] & 0xF)
-                            current_note = value
-                            duration = int(rom[start_addr + 1]) * duration_multiplier
-                            track.append(WSG.Note(timestamp[track_id], value, duration))
-                            volume_index = vol_addr[track_id]
-                            fx_counter = 0
-
-                        start_addr += 2
-                    else:
-                        value = rom[volume_index]
-                        if value < 0x10:
-                            current_volume = value
-                            volume_index += 1
-                        elif value == 0x20:
-                            volume_index = vol_addr[track_id]
-                            continue
-                        elif value == 0x30:
-                            if current_volume >= duration:
-                                current_volume = duration
-                        elif value == 0x40:
-                            fx_counter += 1
-                            if fx_counter > duration:
-                                current_volume = 0
-                        elif value == 0x50:
-                            if current_volume > rom[volume_index + 1]:
-                                current_volume -= 1
-                            else:
-                                current_volume = rom[volume_index + 1]
-                                volume_index += 2
-                        else:
-                            if value != 0x10:
-                                raise Exception('Unsupported volume command %02X' % value)
-
-                        if not current_note:
-                            current_volume = 0
-
-                        if prev_volume != current_volume:
-                            track.append(WSG.Volume(timestamp[track_id], current_volume))
-                            prev_volume = current_volume
-
-                        timestamp[track_id] += 1
-                        duration -= 1
+                    track.RegisterSize(0, 20)
+
+                track.Wave(timestamp[track_id], rom[start_addr] >> 4)
+                track.VolumeCommand(timestamp[track_id], rom[start_addr + 1])
+
+                state = MappyTrack(rom, start_addr + 2, track)
+                state.envelopes = sequencer.envelopes
+                state.timestamp = timestamp[track_id]
+                state.notes = self.notes
+                state.volumes = self.volumes
+                state.note_pitches = self.note_pitches
+                state.pitches = self.note_pitches(uint16_b(rom, self.notes + rom[track_addr + 2] * 2), 4)
+                state.vol_addr = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
+                state.duration_multiplier = duration_multiplier
+                state.current_volume = current_volume
+                sequencer.run(state)
+                timestamp[track_id] = state.timestamp
+                current_volume = state.current_volume
 
                 if len(tracks) <= track_id:
                     tracks.append(track)
@@ -578,9 +680,14 @@ class Reader:
         #  - Namco Super Pacman: todruaga, digdug2, motos
         #  - Namco System 16 Universal: toypop
 
-        rom = self.rom
+        sequencer = self.sequencer(TodruagaTrack)
+        rom = sequencer.rom
 
         timestamp_max = self.loop_end
+        # songs jumping back are played up to loop_end unless their loop is found, the loop settings of the json
+        # have priority
+        song = self.song_info(song_nr)
+        detect_loop = 'loop' not in song and 'loop_offset' not in song and 'loop_end' not in song
 
         # calculate address limits for all songs
         track_addr = [uint16_b(rom, self.songs + i * 2) for i in range(self.total_songs)]
@@ -603,7 +710,8 @@ class Reader:
             ind = vol_start
             while True:
                 if rom[ind] in {0x10, 0x12, 0x13, 0x14}:
-                    vol_envelopes.append(rom[vol_start:ind + 1])
+                    # envelopes are kept as arrays of the ROM image
+                    vol_envelopes.append(self.rom[vol_start:ind + 1])
                     break
                 ind += 1
 
@@ -617,159 +725,75 @@ class Reader:
             track_addr += 3
 
         # read all tracks
+        states = []
         for num, index in enumerate(event_addr):
-            track = []
-            timestamp = 0
-            repeats = 0
-            nonrepeats = 0
-            current_value = 0
-            duration = 0
-            duration_multiplier = 1
-            current_volume = 0
-            prev_volume = 0
-            vol_start = -1
-            vol_index = -1
-            vol_ignore = 0
-
+            track = WSG.Track()
             if num == 0:
-                track.append(WSG.Wavetable(timestamp, self.wavetable))
-                track.append(WSG.SampleRate(0, 24000))
-                track.append(WSG.FrameRate(0, 18432000 / 3 / (384 * 264)))
-
-            track.append(WSG.RegisterSize(0, 20))
-
-            while True:
-                if duration == 0:
-                    if rom[index] == 0xF0:
-                        # wave nr
-                        track.append(WSG.Wave(timestamp, rom[index + 1] >> 4))
-                        index += 2
-                    elif rom[index] == 0xF1:
-                        # volume envelope
-                        vol_env = rom[index + 1]
-                        if vol_env > self.volume_length:
-                            print('substitue volume from %02X to %02X' % (vol_env, 0x0E))
-                            vol_env = 0x0E
-                        vol_start = uint16_b(rom, self.volumes + vol_env * 2)
-                        vol_index = vol_start
-                        track.append(WSG.VolumeCommand(timestamp, vol_env, vol_envelopes[vol_env]))
-                        index += 2
-                        vol_ignore = 0  # perhaps this should not be set here?
-                    elif rom[index] == 0xF2:
-                        # duration multiplier
-                        duration_multiplier = rom[index + 1]
-                        index += 2
-                    elif rom[index] == 0xF3:
-                        # end of track
-                        break
-                    elif rom[index] == 0xF4:
-                        # conditional skip x times
-                        repeats += 1
-                        if rom[index + 1] > repeats:
-                            index = uint16_b(rom, index + 2)
-                        else:
-                            repeats = 0
-                            index += 4
-                    elif rom[index] == 0xF5:
-                        # conditional jump after x times
-                        nonrepeats += 1
-                        if rom[index + 1] == nonrepeats:
-                            index = uint16_b(rom, index + 2)
-                            nonrepeats = 0
-                        else:
-                            index += 4
-                    elif rom[index] == 0xF6:
-                        # unconditional jump
-                        index = uint16_b(rom, index + 1)
-                    elif rom[index] == 0xF7:
-                        #  reset volume envelope vol_ignore = 0
-                        vol_ignore = 0  # not sure that this has any effect as the
-                        index += 1
-                    # duration multiplier
-                    elif rom[index] < 0xF0:
-                        # get a register value from the note lookup
-                        offset = note_addr[num] + (rom[index] >> 4) * 3
-                        current_value = int.from_bytes(rom[offset:offset + 3], 'big')
-                        # apply octave divider
-                        current_value >>= (rom[index] & 0xF)
-                        duration = int(rom[index + 1]) * duration_multiplier
-                        if current_value:
-                            track.append(WSG.Note(timestamp, current_value, duration))
-                        if vol_ignore == 0:
-                            vol_index = vol_start
-                        index += 2
-                    else:
-                        raise Exception('Unrecognised command %02X' % (rom[index]))
-                else:
-                    # volume processing for each channel
-                    if rom[vol_index] < 0x10:
-                        # direct value
-                        current_volume = rom[vol_index]
-                        vol_index += 1
-                    elif rom[vol_index] == 0x10:
-                        # keep the last value (sustain)
-                        pass
-                    elif rom[vol_index] == 0x11:
-                        # volume slide down
-                        if current_volume > rom[vol_index + 1]:
-                            current_volume -= 1
-                        else:
-                            current_volume = rom[vol_index + 1]
-                            vol_index += 2
-                    elif rom[vol_index] == 0x12:
-                        # volume fade out, duration dependent
-                        if current_volume >= duration:
-                            current_volume = duration - 1
-                    elif rom[vol_index] == 0x13:
-                        # reset envelope, loop
-                        vol_index = vol_start
-                        current_volume = rom[vol_index]
-                        vol_index += 1
-                    elif rom[vol_index] == 0x14:
-                        # ignore envelope resets, used mainly with fx
-                        vol_ignore = 1
-                        current_volume = rom[vol_index + 1]
-                        vol_index += 2
-                    else:
-                        raise Exception('Unsupported volume command %02X' % rom[vol_index])
-
-                    if not current_value:
-                        current_volume = 0
-
-                    if prev_volume != current_volume:
-                        track.append(WSG.Volume(timestamp, current_volume))
-                        prev_volume = current_volume
-
-                    timestamp += 1
-                    duration -= 1
-                    if timestamp > timestamp_max:
-                        break
-
-            timestamp_max = min(timestamp, timestamp_max)
+                track.Wavetable(0, self.wavetable)
+                track.SampleRate(0, 24000)
+                track.FrameRate(0, 18432000 / 3 / (384 * 264))
+
+            track.RegisterSize(0, 20)
+
+            state = TodruagaTrack(rom, index, track)
+            state.envelopes = sequencer.envelopes
+            state.volumes = self.volumes
+            state.volume_length = self.volume_length
+            state.vol_envelopes = vol_envelopes
+            state.pitches = self.note_pitches(note_addr[num], 3)
+            states.append(state)
             tracks.append(track)
 
+        # the tracks are played side by side so that none is played past the end of the song
+        timestamp_max = sequencer.schedule(states, timestamp_max, detect_loop)
+
+        # the song loops once all tracks are back where their loop started, one pass of the loop is kept
+        if states and all(state.loop for state in states):
+            loop_start = max(state.loop[0] for state in states)
+            loop_length = 1
+            for state in states:
+                loop_length = loop_length * state.loop[1] // math.gcd(loop_length, state.loop[1])
+            if loop_start + loop_length <= timestamp_max:
+                # the tracks repeat from loop_start on so any frame of the first pass starts the same loop, the first
+                # one no note plays through is taken: the voices are keyed off at the loop point and a note sounding
+                # there would be cut on the jump back
+                for state in states:
+                    sequencer.run(state, loop_start + loop_length)
+                loop_start = WSG.note_boundary(tracks, loop_start, loop_length)
+                if loop_start is not None and loop_start + loop_length <= timestamp_max:
+                    self.loop = (loop_start, loop_length)
+                    timestamp_max = loop_start + loop_length
+
+        # the tracks stopped at their loop play on to the end of the song
+        for state in states:
+            if state.loop is not None:
+                sequencer.run(state, timestamp_max)
+
         # adjust the final length
         # any track finishing first terminates the song so track lengths need to be adjusted
         for track in tracks:
-            for event in reversed(track):
-                if event.timestamp > timestamp_max:
-                    track.pop()
-                elif event.__class__.__name__ == 'Note':
-                    event.duration = min(event.duration, timestamp_max - event.timestamp)
-                    break
+            if self.loop:
+                # the events at the end belong to the next pass
+                track.Truncate(timestamp_max - 1, 1)
+            else:
+                track.Truncate(timestamp_max)
+        if self.loop:
+            # a rest up to the end so that the song lasts the whole loop
+            tracks[0].Note(timestamp_max - 1, 0, 1)
 
         return tracks
 
     def read_skykid(self, song_nr):
 
-        rom = self.rom
+        sequencer = self.sequencer(SkykidTrack)
+        rom = sequencer.rom
 
         wavetable_addr = uint16_b(rom, self.data_addr)
         self.songs = uint16_b(rom, self.data_addr + 4)
         self.volumes = uint16_b(rom, self.data_addr + 6)
         self.dur_multiplier = uint16_b(rom, self.data_addr + 14)
 
-        wavetable = np.zeros((16, 32))
+        wavetable = np.zeros((16, 32), dtype=np.uint8)
         for n in range(16):
             for v in range(16):
                 value = rom[wavetable_addr + n * 16 + v]
@@ -786,12 +810,9 @@ class Reader:
         current_wave = []
         current_vol = []
         track_control = []
-        timestamp_max = 10000
+        timestamp_max = self.song_length_max.get(song_nr, 10000)
         duration_multiplier = []
 
-        if self.game_name == 'skykid' and song_nr == 2:
-            timestamp_max = 384
-
         # track structure
         # 00-01 track address
         # 02 voice/osc nr
@@ -811,192 +832,591 @@ class Reader:
             track_control.append(rom[track_addr + 4] & 0xF)
             # vol_instr +5
             current_vol.append(rom[track_addr + 5])
-            track_addr += 6
-            if self.game_name == 'baraduke':
-                track_addr += 1
+            track_addr += self.track_entry_size
 
         skiptime = [0] * len(event_addr)
         duration_multiplier.append((0, rom[self.dur_multiplier + song_nr]))
 
         for num, start_addr in enumerate(event_addr):
-            track = []
-            timestamp = 0
-            nonrepeats = 0
-            repeats = 0
-            repeats_2 = 0
-            note_duration = 0
-            current_volume = 0
-            prev_volume = -1
-            track.append(WSG.VolumeCommand(timestamp, current_vol[num]))
-            vol_addr =  uint16_b(rom, self.volumes + current_vol[num] * 2)
-            vol_index = vol_addr
+            track = WSG.Track()
+            track.VolumeCommand(0, current_vol[num])
 
             if num == 0:
-                track.append(WSG.Wavetable(timestamp, wavetable))
-                track.append(WSG.SampleRate(timestamp, 24000))
-                track.append(WSG.FrameRate(0, 18432000 / 3 / (384 * 264)))
-
-            track.append(WSG.RegisterSize(timestamp, 20))
-            track.append(WSG.Wave(timestamp, current_wave[num]))
-            special_mode = 0
-            timestamp = skiptime[num]
-            cwave = current_wave[num]
-
-            while rom[start_addr] != 0xE0 or note_duration:
-                if special_mode and rom[start_addr] == 0:
-                    start_addr += 1
-                    continue
-                if note_duration == 0:
-                    if rom[start_addr] > 0xE0:
-                        if rom[start_addr] == 0xE1:
-                            current_wave[num] = (rom[start_addr + 1] >> 4)
-                            cwave = current_wave[num]
-                            track.append(WSG.Wave(timestamp, cwave))
-                            start_addr += 2
-                        elif rom[start_addr] == 0xE3:
-                            track.append(WSG.VolumeCommand(timestamp, rom[start_addr + 1]))
-                            vol_addr = uint16_b(rom, self.volumes + rom[start_addr + 1] * 2)
-                            start_addr += 2
-                        elif rom[start_addr] == 0xE4:
-                            current_vol[num] += rom[start_addr + 1]
-                            current_vol[num] &= 0xF
-                            track.append(WSG.VolumeCommand(timestamp, current_vol[num]))
-                            vol_addr = uint16_b(rom, self.volumes + current_vol[num] * 2)
-                            start_addr += 2
-                        elif rom[start_addr] == 0xE5:
-                            repeats += 1
-                            if rom[start_addr + 1] > repeats:
-                                start_addr = uint16_b(rom, start_addr + 2)
-                            else:
-                                repeats = 0
-                                start_addr += 4
-                        elif rom[start_addr] == 0xE7:
-                            repeats_2 += 1
-                            if rom[start_addr + 1] > repeats_2:
-                                start_addr = uint16_b(rom, start_addr + 2)
-                            else:
-                                start_addr += 4
-                        elif rom[start_addr] == 0xE8:
-                            nonrepeats += 1
-                            if rom[start_addr + 1] == nonrepeats:
-                                start_addr = uint16_b(rom, start_addr + 2)
-                                nonrepeats = 0
-                            else:
-                                start_addr += 4
-                        elif rom[start_addr] == 0xE9:
-                            start_addr = uint16_b(rom, start_addr + 1)
-                        elif rom[start_addr] == 0xEA:
+                track.Wavetable(0, wavetable)
+                track.SampleRate(0, 24000)
+                track.FrameRate(0, 18432000 / 3 / (384 * 264))
+
+            track.RegisterSize(0, 20)
+            track.Wave(0, current_wave[num])
+
+            state = SkykidTrack(rom, start_addr, track)
+            state.envelopes = sequencer.envelopes
+            state.num = num
+            state.timestamp = skiptime[num]
+            state.volumes = self.volumes
+            state.pitches = self.note_pitches(self.notes, 3, note_transpose[num], fine_tune[num])
+            state.vol_addr = uint16_b(rom, self.volumes + current_vol[num] * 2)
+            state.vol_index = state.vol_addr
+            state.cwave = current_wave[num]
+            # shared between the tracks of the song
+            state.current_wave = current_wave
+            state.current_vol = current_vol
+            state.track_control = track_control
+            state.skiptime = skiptime
+            state.duration_multiplier = duration_multiplier
+            state.song_duration_multiplier = rom[self.dur_multiplier + song_nr]
+
+            # commands are only read between notes, the 0xE0 end of track waits for the last note to finish
+            while rom[state.addr] != 0xE0 or state.duration:
+                if state.duration == 0:
+                    if rom[state.addr] > 0xE0:
+                        if sequencer.step(state):
                             break
-                            # noise on
-                            special_mode = 1
-                            start_addr += 1
-                        elif rom[start_addr] == 0xEF:
-                            if track_control[num]:
-                                track_control[num] = 0
-                            else:
-                                track_control[num] = rom[start_addr + 1]
-                            start_addr += 2
-                        elif rom[start_addr] == 0xF0:
-                            if track_control[num]:
-                                for t in range(track_control[num]):
-                                    skiptime[t + num + 1] = timestamp
-                            start_addr += 1
-                        elif rom[start_addr] == 0xEB:
-                            # noise off
-                            start_addr += 1
-                        # master track
-                        # changing global duration multiplier for all tracks
-                        elif rom[start_addr] == 0xF1:
-                            duration_multiplier.append((timestamp, duration_multiplier[-1][1] + rom[start_addr + 1]))
-                            start_addr += 2
-                        elif rom[start_addr] == 0xF2:
-                            duration_multiplier.append((timestamp, rom[self.dur_multiplier + song_nr]))
-                            start_addr += 1
-                        elif rom[start_addr] > 0xE0:
-                            raise Exception('Unknown command %02X' % rom[start_addr])
                         continue
-                    else:
-                        if cwave != current_wave[num]:
-                            cwave = current_wave[num]
-                            track.append(WSG.Wave(timestamp, cwave))
-                        value = 0
-                        if (rom[start_addr] >> 4) < 0xC:
-                            offset = self.notes + ((rom[start_addr] >> 4) + note_transpose[num]) * 3
-                            value = int.from_bytes(rom[offset:offset + 3], byteorder='big')
-                            value += fine_tune[num] * (value >> 8)
-                            # apply octave divider
-                            value >>= (rom[start_addr] & 0xF)
-                        dmult = 1
-                        for dm in duration_multiplier:
-                            if dm[0] <= timestamp:
-                                dmult = dm[1]
-                            else:
-                                break
-                        note_duration = int(rom[start_addr + 1]) * dmult
-                        note_duration &= 0xFF
-                        track.append(WSG.Note(timestamp, value, note_duration))
-                        index_note = len(track) - 1
-                        start_addr += 2
-                        vol_index = vol_addr
-
-                # pitch correction
-                if rom[vol_index] == 0x1E:
-                    rate = int.from_bytes(rom[vol_index + 1], byteorder='big', signed=True)
-                    for i in range(abs(rate)):
-                        if rate > 0:
-                            value += (value >> 8)
-                        else:
-                            value -= (value >> 8)
-                    dt = timestamp - track[index_note].timestamp
-                    new_duration = track[index_note].duration - dt
-                    track[index_note].duration = dt
-                    track.append(WSG.Note(timestamp, value, new_duration))
-                    index_note = len(track) - 1
-                    vol_index += 2
-                    continue
-                elif rom[vol_index] == 0x1C:
-                    cwave += (rom[vol_index + 1] >> 4)
-                    cwave &= 0xF
-                    track.append(WSG.Wave(timestamp, cwave))
-                    vol_index += 2
-                    continue
-
-                if note_duration and value == 0:
-                    current_volume = 0
-                else:
-                    vol_value = rom[vol_index]
-                    if vol_value < 0x10:
-                        current_volume = vol_value
-                        vol_index += 1
-                    elif vol_value == 0x12:
-                        if current_volume >= note_duration:
-                            current_volume = note_duration - 1
-                    elif vol_value == 0x14:
-                        vol_index = vol_addr
-                        current_volume = rom[vol_index]
-                        vol_index += 1
-                    elif vol_value == 0x16:
-                        if current_volume > rom[vol_index + 1]:
-                            current_volume -= 1
-                        else:
-                            current_volume = rom[vol_index + 1]
-                            vol_index += 2
-                    else:
-                        if vol_value != 0x10:
-                            raise Exception('Unsupported volume command %02X' % vol_value)
-
-                if prev_volume != current_volume:
-                    track.append(WSG.Volume(timestamp, current_volume))
-                    prev_volume = current_volume
+                    sequencer.step(state)
 
-                timestamp += 1
-                note_duration -= 1
-                if timestamp > timestamp_max:
+                if state.tick(timestamp_max) and state.timestamp > timestamp_max:
                     break
 
-            if timestamp < timestamp_max:
-                timestamp_max = timestamp
+            if state.timestamp < timestamp_max:
+                timestamp_max = state.timestamp
 
             tracks.append(track)
 
         return tracks
+
+
+class GrobdaTrack(WSGSequencer.Track):
+    """ Grobda and Libble Rabble: notes are a 3 byte register value shifted by the octave, the volume envelope restarts
+    with each note unless disabled """
+
+    def __init__(self, rom, addr, events):
+        super().__init__(rom, addr, events)
+        self.repeats = 0
+        self.nonrepeats = 0
+        self.nonrepeats_2 = 0
+        self.vol_index = 0
+        self.ignore_env = 0
+        self.ignore_jump = 0
+
+    def end(self, op, args):
+        return True
+
+    def wave(self, op, args):
+        self.events.Wave(self.timestamp, args[0] >> 4)
+
+    def volume_command(self, op, args):
+        self.events.VolumeCommand(self.timestamp, args[0])
+        self.vol_addr = uint16_b(self.rom, self.volumes + args[0] * 2)
+        self.ignore_env = 0
+
+    def repeat(self, op, args):
+        # conditional jump nr of times
+        self.repeats += 1
+        if args[0] <= self.repeats or self.ignore_jump:
+            self.repeats = 0
+        else:
+            self.addr = args[1]
+
+    def ignore_repeat(self, op, args):
+        # ignore conditional jump F3
+        self.ignore_jump = 1
+
+    def jump_after(self, op, args):
+        # conditional jump after x times
+        self.nonrepeats += 1
+        if args[0] == self.nonrepeats:
+            self.addr = args[1]
+            self.nonrepeats = 0
+
+    def jump_after_2(self, op, args):
+        # conditional jump
+        self.nonrepeats_2 += 1
+        if args[0] == self.nonrepeats_2:
+            self.addr = args[1]
+            self.nonrepeats_2 = 0
+
+    def jump(self, op, args):
+        # unconditional jump
+        self.addr = args[0]
+
+    def unknown(self, op, args):
+        raise Exception('Unrecognised command %02X' % op)
+
+    def note(self, op, args):
+        # get a register value from the note lookup
+        current_note = 0
+        if op >> 4 != 0xC:
+            # register value of the note in its octave
+            current_note = self.pitches[op]
+        self.duration = args[0] * self.duration_multiplier
+        self.events.Note(self.timestamp, current_note, self.duration)
+        if self.ignore_env == 0:
+            self.vol_index = self.vol_addr
+
+    def tick(self, timestamp_max=None):
+        envelope = self.envelopes.compile(self.envelope_step, self.vol_addr, self.vol_index, self.current_volume,
+                                          self.duration, self.frames(timestamp_max))
+        self.vol_index = envelope.index
+        self.play(envelope)
+
+    @staticmethod
+    def envelope_step(rom, start, index, volume, remaining, extra, silent):
+        # volume processing for each channel
+        value = rom[index]
+        if value < 0x10:
+            volume = value
+            index += 1
+        elif value == 0x12:
+            if volume >= remaining:
+                volume = remaining - 1
+        elif value == 0x14:
+            index = start
+            volume = rom[index]
+            index += 1
+        elif value == 0x16:
+            if volume > rom[index + 1]:
+                volume -= 1
+            else:
+                volume = rom[index + 1]
+                index += 2
+        else:
+            if value != 0x10:
+                raise Exception('Unsupported volume command %02X' % value)
+        return index, volume, extra, ()
+
+
+GrobdaTrack.commands = WSGSequencer.command_table({
+    0xF0: (GrobdaTrack.end, ''),
+    0xF1: (GrobdaTrack.wave, 'b'),
+    0xF2: (GrobdaTrack.volume_command, 'b'),
+    0xF3: (GrobdaTrack.repeat, 'bw'),
+    0xF4: (GrobdaTrack.ignore_repeat, 'b'),
+    0xF5: (GrobdaTrack.jump_after, 'bw'),
+    0xF6: (GrobdaTrack.jump_after_2, 'bw'),
+    0xF7: (GrobdaTrack.jump, 'w'),
+}, (GrobdaTrack.note, 'b'), 0xF0, GrobdaTrack.unknown)
+
+
+class MappyTrack(WSGSequencer.Track):
+    """ Mappy: 4 byte note values, the volume envelope restarts with each note """
+
+    def __init__(self, rom, addr, events):
+        super().__init__(rom, addr, events)
+        self.current_note = 0
+        self.fx_counter = 0
+        self.volume_index = 0
+
+    def tuning(self, op, args):
+        # note tuning
+        self.pitches = self.note_pitches(uint16_b(self.rom, self.notes + args[0] * 2), 4)
+
+    def wave(self, op, args):
+        # wave nr
+        self.events.Wave(self.timestamp, args[0] >> 4)
+
+    def volume_command(self, op, args):
+        self.events.VolumeCommand(self.timestamp, args[0])
+        self.vol_addr = uint16_b(self.rom, self.volumes + args[0] * 2)
+
+    def end(self, op, args):
+        return True
+
+    def unknown(self, op, args):
+        raise Exception('Unrecognised command %02X' % op)
+
+    def note(self, op, args):
+        # register value of the note in its octave
+        value = self.pitches[op]
+        self.current_note = value
+        self.duration = args[0] * self.duration_multiplier
+        self.events.Note(self.timestamp, value, self.duration)
+        self.volume_index = self.vol_addr
+        self.fx_counter = 0
+
+    def tick(self, timestamp_max=None):
+        envelope = self.envelopes.compile(self.envelope_step, self.vol_addr, self.volume_index, self.current_volume,
+                                          self.duration, self.frames(timestamp_max), self.fx_counter,
+                                          not self.current_note)
+        self.volume_index = envelope.index
+        self.fx_counter = envelope.extra
+        self.play(envelope)
+
+    @staticmethod
+    def envelope_step(rom, start, index, volume, remaining, fx_counter, silent):
+        value = rom[index]
+        while value == 0x20:
+            # envelope loop, the frame is processed again from the start
+            index = start
+            value = rom[index]
+        if value < 0x10:
+            volume = value
+            index += 1
+        elif value == 0x30:
+            if volume >= remaining:
+                volume = remaining
+        elif value == 0x40:
+            fx_counter += 1
+            if fx_counter > remaining:
+                volume = 0
+        elif value == 0x50:
+            if volume > rom[index + 1]:
+                volume -= 1
+            else:
+                volume = rom[index + 1]
+                index += 2
+        else:
+            if value != 0x10:
+                raise Exception('Unsupported volume command %02X' % value)
+
+        if silent:
+            volume = 0
+        return index, volume, fx_counter, ()
+
+
+MappyTrack.commands = WSGSequencer.command_table({
+    0xF0: (MappyTrack.tuning, 'b'),
+    0xF1: (MappyTrack.wave, 'b'),
+    0xF2: (MappyTrack.volume_command, 'b'),
+    0xF3: (MappyTrack.end, 'b'),
+}, (MappyTrack.note, 'b'), 0xF0, MappyTrack.unknown)
+
+
+class TodruagaTrack(WSGSequencer.Track):
+    """ Super Pacman and System 16 Universal (todruaga, digdug2, motos, toypop): 3 byte note values, a rest is a note
+    with a zero register value """
+
+    state_fields = ('addr', 'duration', 'repeats', 'nonrepeats', 'current_value', 'duration_multiplier',
+                    'current_volume', 'prev_volume', 'vol_start', 'vol_index', 'vol_ignore', 'wave_nr')
+
+    def __init__(self, rom, addr, events):
+        super().__init__(rom, addr, events)
+        self.repeats = 0
+        self.nonrepeats = 0
+        self.current_value = 0
+        self.duration_multiplier = 1
+        self.vol_start = -1
+        self.vol_index = -1
+        self.vol_ignore = 0
+        self.wave_nr = None
+
+    def wave(self, op, args):
+        # wave nr, kept for the loop detection as the notes play with it
+        self.wave_nr = args[0] >> 4
+        self.events.Wave(self.timestamp, self.wave_nr)
+
+    def volume_envelope(self, op, args):
+        vol_env = args[0]
+        if vol_env > self.volume_length:
+            # an envelope past the table is replaced by 0x0E, counted with the parse stage
+            WSGProfile.count(WSGProfile.PARSE, volume_substitutions=1)
+            vol_env = 0x0E
+        self.vol_start = uint16_b(self.rom, self.volumes + vol_env * 2)
+        self.vol_index = self.vol_start
+        self.events.VolumeCommand(self.timestamp, vol_env, self.vol_envelopes[vol_env])
+        self.vol_ignore = 0  # perhaps this should not be set here?
+
+    def set_duration_multiplier(self, op, args):
+        self.duration_multiplier = args[0]
+
+    def end(self, op, args):
+        return True
+
+    def repeat(self, op, args):
+        # conditional skip x times
+        self.repeats += 1
+        if args[0] > self.repeats:
+            self.addr = args[1]
+        else:
+            self.repeats = 0
+
+    def jump_after(self, op, args):
+        # conditional jump after x times
+        self.nonrepeats += 1
+        if args[0] == self.nonrepeats:
+            self.addr = args[1]
+            self.nonrepeats = 0
+
+    def jump(self, op, args):
+        # unconditional jump
+        self.addr = args[0]
+
+    def reset_envelope(self, op, args):
+        self.vol_ignore = 0  # not sure that this has any effect
+
+    def unknown(self, op, args):
+        raise Exception('Unrecognised command %02X' % op)
+
+    def note(self, op, args):
+        # register value of the note in its octave
+        self.current_value = self.pitches[op]
+        self.duration = args[0] * self.duration_multiplier
+        if self.current_value:
+            self.events.Note(self.timestamp, self.current_value, self.duration)
+        if self.vol_ignore == 0:
+            self.vol_index = self.vol_start
+
+    def tick(self, timestamp_max=None):
+        envelope = self.envelopes.compile(self.envelope_step, self.vol_start, self.vol_index, self.current_volume,
+                                          self.duration, self.frames(timestamp_max), self.vol_ignore,
+                                          not self.current_value)
+        self.vol_index = envelope.index
+        self.vol_ignore = envelope.extra
+        self.play(envelope)
+
+    @staticmethod
+    def envelope_step(rom, start, index, volume, remaining, vol_ignore, silent):
+        # volume processing for each channel
+        value = rom[index]
+        if value < 0x10:
+            # direct value
+            volume = value
+            index += 1
+        elif value == 0x10:
+            # keep the last value (sustain)
+            pass
+        elif value == 0x11:
+            # volume slide down
+            if volume > rom[index + 1]:
+                volume -= 1
+            else:
+                volume = rom[index + 1]
+                index += 2
+        elif value == 0x12:
+            # volume fade out, duration dependent
+            if volume >= remaining:
+                volume = remaining - 1
+        elif value == 0x13:
+            # reset envelope, loop
+            index = start
+            volume = rom[index]
+            index += 1
+        elif value == 0x14:
+            # ignore envelope resets, used mainly with fx
+            vol_ignore = 1
+            volume = rom[index + 1]
+            index += 2
+        else:
+            raise Exception('Unsupported volume command %02X' % value)
+
+        if silent:
+            volume = 0
+        return index, volume, vol_ignore, ()
+
+
+TodruagaTrack.commands = WSGSequencer.command_table({
+    0xF0: (TodruagaTrack.wave, 'b'),
+    0xF1: (TodruagaTrack.volume_envelope, 'b'),
+    0xF2: (TodruagaTrack.set_duration_multiplier, 'b'),
+    0xF3: (TodruagaTrack.end, ''),
+    0xF4: (TodruagaTrack.repeat, 'bw'),
+    0xF5: (TodruagaTrack.jump_after, 'bw'),
+    0xF6: (TodruagaTrack.jump, 'w'),
+    0xF7: (TodruagaTrack.reset_envelope, ''),
+}, (TodruagaTrack.note, 'b'), 0xF0, TodruagaTrack.unknown)
+
+
+class SkykidTrack(WSGSequencer.Track):
+    """ Sky Kid, Dragon Buster, Metro-Cross, Pac-Land and Baraduke: the volume envelope can also bend the pitch and
+    change the wave while a note plays, the master track changes the duration multiplier of all tracks """
+
+    def __init__(self, rom, addr, events):
+        super().__init__(rom, addr, events)
+        self.nonrepeats = 0
+        self.repeats = 0
+        self.repeats_2 = 0
+        self.prev_volume = -1
+        self.value = 0
+        self.index_note = 0
+
+    def wave(self, op, args):
+        self.current_wave[self.num] = (args[0] >> 4)
+        self.cwave = self.current_wave[self.num]
+        self.events.Wave(self.timestamp, self.cwave)
+
+    def volume_command(self, op, args):
+        self.events.VolumeCommand(self.timestamp, args[0])
+        self.vol_addr = uint16_b(self.rom, self.volumes + args[0] * 2)
+
+    def volume_add(self, op, args):
+        self.current_vol[self.num] += args[0]
+        self.current_vol[self.num] &= 0xF
+        self.events.VolumeCommand(self.timestamp, self.current_vol[self.num])
+        self.vol_addr = uint16_b(self.rom, self.volumes + self.current_vol[self.num] * 2)
+
+    def repeat(self, op, args):
+        self.repeats += 1
+        if args[0] > self.repeats:
+            self.addr = args[1]
+        else:
+            self.repeats = 0
+
+    def repeat_2(self, op, args):
+        self.repeats_2 += 1
+        if args[0] > self.repeats_2:
+            self.addr = args[1]
+
+    def jump_after(self, op, args):
+        self.nonrepeats += 1
+        if args[0] == self.nonrepeats:
+            self.addr = args[1]
+            self.nonrepeats = 0
+
+    def jump(self, op, args):
+        self.addr = args[0]
+
+    def noise_on(self, op, args):
+        # noise is not supported, the track ends here
+        return True
+
+    def noise_off(self, op, args):
+        pass
+
+    def set_track_control(self, op, args):
+        if self.track_control[self.num]:
+            self.track_control[self.num] = 0
+        else:
+            self.track_control[self.num] = args[0]
+
+    def skip_time(self, op, args):
+        if self.track_control[self.num]:
+            for t in range(self.track_control[self.num]):
+                self.skiptime[t + self.num + 1] = self.timestamp
+
+    # master track
+    # changing global duration multiplier for all tracks
+    def add_duration_multiplier(self, op, args):
+        self.duration_multiplier.append((self.timestamp, self.duration_multiplier[-1][1] + args[0]))
+
+    def reset_duration_multiplier(self, op, args):
+        self.duration_multiplier.append((self.timestamp, self.song_duration_multiplier))
+
+    def unknown(self, op, args):
+        raise Exception('Unknown command %02X' % op)
+
+    def note(self, op, args):
+        if self.cwave != self.current_wave[self.num]:
+            self.cwave = self.current_wave[self.num]
+            self.events.Wave(self.timestamp, self.cwave)
+        value = 0
+        if (op >> 4) < 0xC:
+            # register value of the note transposed, fine tuned and in its octave
+            value = self.pitches[op]
+        dmult = 1
+        for dm in self.duration_multiplier:
+            if dm[0] <= self.timestamp:
+                dmult = dm[1]
+            else:
+                break
+        self.duration = args[0] * dmult
+        self.duration &= 0xFF
+        self.value = value
+        self.events.Note(self.timestamp, value, self.duration)
+        self.index_note = len(self.events) - 1
+        self.vol_index = self.vol_addr
+
+    def tick(self, timestamp_max=None):
+        """ play the note with its volume envelope, which can also bend the pitch and change the wave. A note without
+        duration plays on until timestamp_max, unless its envelope starts with a pitch or wave change: only the change
+        is made and False returned, the track goes on with the next command """
+        rom = self.rom
+        if self.duration == 0 and rom[self.vol_index] in (0x1C, 0x1E):
+            self.effect(self.timestamp, rom[self.vol_index], rom[self.vol_index + 1])
+            self.vol_index += 2
+            return False
+
+        if self.duration > 0:
+            frames = self.frames(timestamp_max)
+        else:
+            frames = max(1, timestamp_max + 1 - self.timestamp)
+        envelope = self.envelopes.compile(self.envelope_step, self.vol_addr, self.vol_index, self.current_volume,
+                                          self.duration, frames, 0, self.value == 0)
+        self.vol_index = envelope.index
+
+        # the pitch and wave changes of a frame come before its volume
+        effects = iter(envelope.effects)
+        effect = next(effects, None)
+        for tick, volume in envelope.points:
+            while effect is not None and effect[0] <= tick:
+                self.effect(self.timestamp + effect[0], effect[1], effect[2])
+                effect = next(effects, None)
+            if volume != self.prev_volume:
+                self.events.Volume(self.timestamp + tick, volume)
+                self.prev_volume = volume
+        while effect is not None:
+            self.effect(self.timestamp + effect[0], effect[1], effect[2])
+            effect = next(effects, None)
+
+        self.current_volume = envelope.volume
+        self.timestamp += frames
+        self.duration -= frames
+        return True
+
+    def effect(self, timestamp, op, arg):
+        track = self.events
+        if op == 0x1E:
+            # pitch correction
+            rate = arg - 0x100 if arg & 0x80 else arg
+            for i in range(abs(rate)):
+                if rate > 0:
+                    self.value += (self.value >> 8)
+                else:
+                    self.value -= (self.value >> 8)
+            dt = timestamp - track.timestamp[self.index_note]
+            new_duration = track.duration[self.index_note] - dt
+            track.duration[self.index_note] = dt
+            track.Note(timestamp, self.value, new_duration)
+            self.index_note = len(track) - 1
+        else:
+            self.cwave += (arg >> 4)
+            self.cwave &= 0xF
+            track.Wave(timestamp, self.cwave)
+
+    @staticmethod
+    def envelope_step(rom, start, index, volume, remaining, extra, silent):
+        effects = []
+        while rom[index] in (0x1C, 0x1E):
+            effects.append((rom[index], rom[index + 1]))
+            index += 2
+
+        if remaining and silent:
+            volume = 0
+        else:
+            vol_value = rom[index]
+            if vol_value < 0x10:
+                volume = vol_value
+                index += 1
+            elif vol_value == 0x12:
+                if volume >= remaining:
+                    volume = remaining - 1
+            elif vol_value == 0x14:
+                index = start
+                volume = rom[index]
+                index += 1
+            elif vol_value == 0x16:
+                if volume > rom[index + 1]:
+                    volume -= 1
+                else:
+                    volume = rom[index + 1]
+                    index += 2
+            else:
+                if vol_value != 0x10:
+                    raise Exception('Unsupported volume command %02X' % vol_value)
+        return index, volume, extra, effects
+
+
+SkykidTrack.commands = WSGSequencer.command_table({
+    0xE1: (SkykidTrack.wave, 'b'),
+    0xE3: (SkykidTrack.volume_command, 'b'),
+    0xE4: (SkykidTrack.volume_add, 'b'),
+    0xE5: (SkykidTrack.repeat, 'bw'),
+    0xE7: (SkykidTrack.repeat_2, 'bw'),
+    0xE8: (SkykidTrack.jump_after, 'bw'),
+    0xE9: (SkykidTrack.jump, 'w'),
+    0xEA: (SkykidTrack.noise_on, ''),
+    0xEB: (SkykidTrack.noise_off, ''),
+    0xEF: (SkykidTrack.set_track_control, 'b'),
+    0xF0: (SkykidTrack.skip_time, ''),
+    0xF1: (SkykidTrack.add_duration_multiplier, 'b'),
+    0xF2: (SkykidTrack.reset_duration_multiplier, ''),
+}, (SkykidTrack.note, 'b'), 0xE0, SkykidTrack.unknown)
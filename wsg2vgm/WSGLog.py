@@ -0,0 +1,178 @@
+import numpy as np
+import WSG
+import struct
+import io
+
+# WSG register log, the registers of the Namco 15XX written as they are, without the resampling to another chip.
+# All values are little endian.
+#
+# header (0x20 bytes)
+#   0x00 'WSGL'
+#   0x04 u16 version (0x0100)
+#   0x06 u8  voices
+#   0x08 u32 total frames
+#   0x0C u32 loop offset relative to the commands, 0xFFFFFFFF without loop
+#   0x10 u32 frames in the loop
+#   0x14 u32 offset of the commands
+#
+# commands
+#   0x1v ff ff ff  frequency register of voice v (24 bits), 0 silences the voice
+#   0x2v vv        volume of voice v (0-15)
+#   0x3v ww        wave of voice v
+#   0x4v ss        frequency register size of voice v in bits
+#   0x50 rrrrrrrr  register sample rate in Hz (u32)
+#   0x51 f64       frame rate in Hz
+#   0x52 nn ss ..  wavetable, nn waves of ss 4 bit samples, one byte each
+#   0x61 nnnn      wait n frames
+#   0x7n           wait n+1 frames
+#   0x66           end of sound
+
+VERSION = 0x0100
+HEADER_SIZE = 0x20
+
+FREQUENCY, VOLUME, WAVE, REGISTER_SIZE = 0x10, 0x20, 0x30, 0x40
+
+
+class Writer:
+    """ the header and commands of a register log written into a seekable file, or into memory without one """
+
+    def __init__(self, file=None):
+        self.file = file if file is not None else io.BytesIO()
+        self.start = self.file.tell()
+        self.commands_offset = self.start + HEADER_SIZE
+        self.loop_offset = None
+        self.voices = 0
+
+    def __len__(self):
+        return self.file.tell() - self.commands_offset
+
+    def Begin(self, voices):
+        self.voices = voices
+        self.file.write(bytes(HEADER_SIZE))
+
+    def Write(self, data):
+        self.file.write(data)
+
+    def Wait(self, frames):
+        while frames > 0:
+            if frames <= 16:
+                self.Write(struct.pack('<B', 0x70 | (frames - 1)))
+            else:
+                self.Write(struct.pack('<BH', 0x61, min(frames, 0xFFFF)))
+            frames -= min(frames, 0xFFFF)
+
+    def MarkLoop(self):
+        self.loop_offset = len(self)
+
+    def EndOfSound(self):
+        self.Write(struct.pack('<B', 0x66))
+
+    def Finish(self, total_frames, loop_frames=0):
+        """ fill in the header, returns the log when written into memory """
+        loop_offset = 0xFFFFFFFF if self.loop_offset is None else self.loop_offset
+        end = self.file.tell()
+        self.file.seek(self.start)
+        self.file.write(b'WSGL' + struct.pack('<HBxIIII', VERSION, self.voices, total_frames, loop_offset, loop_frames,
+                                              HEADER_SIZE))
+        self.file.seek(end)
+        if isinstance(self.file, io.BytesIO):
+            return self.file.getvalue()
+
+
+class Logger:
+    """ write the events of a song (a WSG.Timeline) as register writes. Only changed registers are written, a note off
+    sets the frequency to 0 like the sound drivers do. All registers are written again at the loop point, as the player
+    arrives there with the state of the song's end """
+
+    def __init__(self, solo=None):
+        self.solo = solo
+
+    def Reset(self, channel_len):
+        self.registers = {}
+        self.noteoff_timestamp = [-1] * channel_len
+        self.track_mute = [False] * channel_len
+        if self.solo:
+            self.track_mute = [True] * channel_len
+            for solo_track in self.solo:
+                if solo_track < channel_len:
+                    self.track_mute[solo_track] = False
+
+    def Register(self, writer, command, voice, value):
+        if self.registers.get((command, voice)) != value:
+            self.registers[(command, voice)] = value
+            if command == FREQUENCY:
+                writer.Write(struct.pack('<BI', command | voice, value)[:4])
+            else:
+                writer.Write(struct.pack('<BB', command | voice, value))
+
+    def Log(self, timeline, output=None, loop_offset=None):
+        """ write the log of the timeline, loop_offset is the loop frame of a looped song. Returns the log unless
+        written into output """
+        writer = Writer(output)
+        writer.Begin(timeline.channels)
+        self.Reset(timeline.channels)
+
+        events = iter(timeline)
+        event = next(events, None)
+        last_frame = len(timeline) - 1
+        timestamp = 0
+        # the loop starts at the beginning unless the loop frame is reached
+        if loop_offset is not None and loop_offset > last_frame:
+            loop_offset = 0
+
+        while timestamp <= last_frame:
+            if loop_offset == timestamp:
+                writer.MarkLoop()
+                registers = self.registers
+                self.registers = {}
+                for (command, voice), value in sorted(registers.items()):
+                    # notes don't carry over the loop point
+                    self.Register(writer, command, voice, 0 if command == FREQUENCY else value)
+
+            for track_nr in range(timeline.channels):
+                if self.noteoff_timestamp[track_nr] == timestamp:
+                    self.Register(writer, FREQUENCY, track_nr, 0)
+
+                while event is not None and event[0] == timestamp and event[1] == track_nr:
+                    code, event_timestamp, value, duration = event[2]
+                    event = next(events, None)
+                    if not self.track_mute[track_nr]:
+                        if code == WSG.NOTE and value:
+                            self.Register(writer, FREQUENCY, track_nr, int(value))
+                            self.noteoff_timestamp[track_nr] = event_timestamp + duration
+                        elif code == WSG.WAVE:
+                            self.Register(writer, WAVE, track_nr, int(value))
+                        elif code == WSG.VOLUME:
+                            self.Register(writer, VOLUME, track_nr, int(value))
+                    if code == WSG.SAMPLE_RATE:
+                        writer.Write(struct.pack('<BI', 0x50, int(value)))
+                    elif code == WSG.FRAME_RATE:
+                        writer.Write(struct.pack('<Bd', 0x51, value))
+                    elif code == WSG.REGISTER_SIZE:
+                        self.Register(writer, REGISTER_SIZE, track_nr, int(value))
+                    elif code == WSG.WAVETABLE:
+                        wavetable = np.asarray(value).astype(np.uint8) & 0xF
+                        writer.Write(struct.pack('<BBB', 0x52, *wavetable.shape) + wavetable.tobytes())
+
+            next_frame = last_frame
+            if event is not None:
+                next_frame = min(next_frame, event[0])
+            for note_off in self.noteoff_timestamp:
+                if timestamp < note_off < next_frame:
+                    next_frame = note_off
+            if loop_offset is not None and timestamp < loop_offset < next_frame:
+                next_frame = loop_offset
+            next_frame = max(next_frame, timestamp + 1)
+
+            writer.Wait(next_frame - timestamp)
+
+            # silence the remaining notes
+            if timestamp == last_frame:
+                for track_nr in range(timeline.channels):
+                    self.Register(writer, FREQUENCY, track_nr, 0)
+
+            timestamp = next_frame
+
+        writer.EndOfSound()
+        loop_frames = 0 if loop_offset is None else len(timeline) - loop_offset
+        return writer.Finish(len(timeline), loop_frames)
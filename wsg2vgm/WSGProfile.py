@@ -0,0 +1,116 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+# stages of the conversion pipeline
+ROM_LOAD, PARSE, ROWS, DATA_BLOCK, EMIT, COMPRESS = 'rom_load', 'parse', 'rows', 'data_block', 'emit', 'compress'
+
+
+class Profile:
+    """ wall time, calls, events produced, bytes emitted and (with memory) the peak of the memory allocated in each
+    stage of the pipeline. Hooks are called as hook(stage, record) at the end of every stage, e.g. to export the
+    numbers as metrics """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+        self.hooks = []
+
+    def Record(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = dict(seconds=0.0, calls=0, events=0, bytes=0)
+            if self.memory:
+                record['peak_memory'] = 0
+            self.stages[name] = record
+        return record
+
+    def Begin(self, name):
+        """ start a stage, the stages are not meant to be nested. Returns what End takes """
+        memory_start = 0
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        return name, memory_start, time.perf_counter()
+
+    def End(self, stage):
+        name, memory_start, start = stage
+        record = self.Record(name)
+        record['seconds'] += time.perf_counter() - start
+        record['calls'] += 1
+        if self.memory:
+            record['peak_memory'] = max(record['peak_memory'], tracemalloc.get_traced_memory()[1] - memory_start)
+        for hook in self.hooks:
+            hook(name, record)
+
+    @contextlib.contextmanager
+    def Stage(self, name):
+        """ time the block as a stage """
+        stage = self.Begin(name)
+        try:
+            yield self.Record(name)
+        finally:
+            self.End(stage)
+
+    def Count(self, name, events=0, size=0, **counters):
+        """ add to the events and bytes of a stage, further counters (e.g. the frequencies clamped) are added to the
+        record as they come """
+        record = self.Record(name)
+        record['events'] += events
+        record['bytes'] += size
+        for counter, value in counters.items():
+            record[counter] = record.get(counter, 0) + value
+
+    def Report(self):
+        return {name: dict(record) for name, record in self.stages.items()}
+
+    def Write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.Report(), f, indent=1)
+
+
+# the active profile, None while profiling is off
+profile = None
+
+
+def enable(memory=False):
+    """ start profiling the pipeline, returns the profile to add hooks to and read the report from """
+    global profile
+    profile = Profile(memory)
+    return profile
+
+
+def disable():
+    global profile
+    profile = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """ time the block as a stage of the active profile, yields its record or None while profiling is off """
+    if profile is None:
+        yield None
+    else:
+        with profile.Stage(name) as record:
+            yield record
+
+
+def begin(name):
+    """ start a stage of the active profile, for code that doesn't fit a with block. Returns what end takes """
+    if profile is not None:
+        return profile.Begin(name)
+
+
+def end(stage):
+    if profile is not None and stage is not None:
+        profile.End(stage)
+
+
+def count(name, events=0, size=0, **counters):
+    if profile is not None:
+        profile.Count(name, events, size, **counters)
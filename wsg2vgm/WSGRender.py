@@ -0,0 +1,143 @@
+import numpy as np
+import WSG
+import itertools
+import wave
+
+
+class Resampler:
+    """ streaming linear interpolation between the WSG sample rate and the output rate """
+
+    def __init__(self, input_rate, output_rate):
+        self.step = input_rate / output_rate
+        self.position = 1.0  # position of the next output sample, index 0 holds the last input sample
+        self.last_sample = 0.0
+
+    def Process(self, samples):
+        buffer = np.concatenate(([self.last_sample], samples))
+        count = int(np.floor((len(buffer) - 1 - self.position) / self.step)) + 1
+        if count <= 0:
+            out = np.zeros(0)
+        else:
+            positions = self.position + np.arange(count) * self.step
+            out = np.interp(positions, np.arange(len(buffer)), buffer)
+            self.position += count * self.step
+        self.position -= len(buffer) - 1
+        self.last_sample = buffer[-1]
+        return out
+
+
+class Renderer:
+    """ render the event rows of a song (see WSG.tracks2rows) into mixed PCM, one WSG register per voice. The registers
+    run at the sample rate given by the SampleRate event, the mix is resampled to output_rate and written out in blocks
+    of block_size frames so that memory stays flat for long songs """
+
+    def __init__(self, output_rate=44100, block_size=4096, solo=None):
+        self.output_rate = output_rate
+        self.block_size = block_size
+        self.solo = solo
+
+    def Reset(self, channel_len):
+        self.registers = [WSG.Register(20) for i in range(channel_len)]
+        self.noteoff_timestamp = [-1] * channel_len
+        self.wave = [-1] * channel_len
+        self.track_mute = [False] * channel_len
+        if self.solo:
+            self.track_mute = [True] * channel_len
+            for solo_track in self.solo:
+                if solo_track < channel_len:
+                    self.track_mute[solo_track] = False
+        self.wavetable = None
+        self.sample_rate = 0
+        self.frame_rate = 0
+        self.frame_dt = 0
+        self.resampler = None
+
+    def ProcessRow(self, timestamp, row):
+        """ apply the events of one frame to the registers """
+        for track_nr, track in enumerate(row):
+            register = self.registers[track_nr]
+            if self.noteoff_timestamp[track_nr] == timestamp:
+                register.value = 0
+
+            for code, event_timestamp, value, duration in track:
+                if not self.track_mute[track_nr]:
+                    if code == WSG.NOTE and value:
+                        register.AssignWavetable(self.wavetable[self.wave[track_nr] & 0xF])
+                        register.value = value
+                        self.noteoff_timestamp[track_nr] = event_timestamp + duration
+                    elif code == WSG.WAVE:
+                        self.wave[track_nr] = value
+                        register.AssignWavetable(self.wavetable[value & 0xF])
+                    elif code == WSG.VOLUME:
+                        register.volume = value
+                if code == WSG.SAMPLE_RATE:
+                    self.sample_rate = value
+                elif code == WSG.FRAME_RATE:
+                    self.frame_rate = value
+                elif code == WSG.REGISTER_SIZE:
+                    # the following writes of the frame go to the new register
+                    register = self.registers[track_nr] = WSG.Register(value)
+                elif code == WSG.WAVETABLE:
+                    self.wavetable = value
+
+    def GenerateFrame(self):
+        """ mix all voices for the duration of one frame and resample to the output rate """
+        if self.resampler is None:
+            self.resampler = Resampler(self.sample_rate, self.output_rate)
+
+        self.frame_dt += self.sample_rate / self.frame_rate
+        sample_length = round(self.frame_dt)
+        self.frame_dt -= sample_length
+
+        mix = np.zeros(sample_length)
+        for track_nr, register in enumerate(self.registers):
+            # a register without a note left in it stays silent
+            if register.value and not self.track_mute[track_nr]:
+                mix += register.Generate(sample_length)
+        mix /= len(self.registers)
+
+        return self.resampler.Process(mix)
+
+    def Stream(self, rows, frame_count=1024, pad=True):
+        """ generator yielding buffers of frame_count samples (floats in -1..1 at output_rate) while the rows are walked
+        frame by frame, so the first buffer is ready as soon as enough frames have been rendered. rows can be any
+        iterable of rows, e.g. WSG.iter_rows. The last buffer is padded with silence unless pad is False """
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        self.Reset(len(first_row))
+
+        pending = []
+        pending_length = 0
+        for timestamp, row in enumerate(itertools.chain([first_row], rows)):
+            self.ProcessRow(timestamp, row)
+            pending.append(self.GenerateFrame())
+            pending_length += len(pending[-1])
+
+            if pending_length >= frame_count:
+                buffer = np.concatenate(pending)
+                for start in range(0, len(buffer) - frame_count + 1, frame_count):
+                    yield buffer[start:start + frame_count]
+                pending = [buffer[len(buffer) // frame_count * frame_count:]]
+                pending_length = len(pending[0])
+
+        if pending_length:
+            buffer = np.concatenate(pending)
+            if pad:
+                buffer = np.concatenate((buffer, np.zeros(frame_count - len(buffer))))
+            yield buffer
+
+    def Render(self, rows, filename):
+        """ render the rows to a mono 16 bit WAV file """
+        with wave.open(filename, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.output_rate)
+
+            for buffer in self.Stream(rows, self.block_size, pad=False):
+                f.writeframes(Renderer.ToPCM(buffer))
+
+    @staticmethod
+    def ToPCM(samples):
+        return (np.clip(samples, -1, 1) * 0x7FFF).astype('<i2').tobytes()
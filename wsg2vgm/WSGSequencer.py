@@ -0,0 +1,187 @@
+import collections
+import heapq
+
+# a compiled volume envelope: the (tick, volume) change points of the frames played, the pitch or wave changes
+# (tick, opcode, argument) of drivers that have them and the state of the envelope after the last frame
+Envelope = collections.namedtuple('Envelope', 'points effects frames index volume extra')
+
+
+class EnvelopeCompiler:
+    """ plays the volume envelope of a note ahead of time, so that the tracks go from one volume change to the next
+    instead of stepping the envelope each frame. step is the driver's envelope for one frame, called as
+    step(rom, start, index, volume, remaining, extra, silent) and returning (index, volume, extra, effects): start is
+    the address of the envelope, index the current position, remaining the frames left of the note, extra a driver
+    specific counter or flag and silent True for a rest. The envelopes are memoized, the least recently used ones are
+    dropped once cache_size is reached """
+    cache_size = 0x4000
+
+    def __init__(self, rom):
+        self.rom = rom
+        self.cache = collections.OrderedDict()
+
+    def compile(self, step, start, index, volume, duration, frames, extra=0, silent=False):
+        """ the first frames of a note of duration frames """
+        key = (step, start, index, volume, duration, frames, extra, silent)
+        envelope = self.cache.get(key)
+        if envelope is not None:
+            self.cache.move_to_end(key)
+            return envelope
+
+        rom = self.rom
+        points = []
+        effects = []
+        for tick in range(frames):
+            index, volume, extra, frame_effects = step(rom, start, index, volume, duration - tick, extra, silent)
+            for op, arg in frame_effects:
+                effects.append((tick, op, arg))
+            if not points or points[-1][1] != volume:
+                points.append((tick, volume))
+
+        envelope = Envelope(tuple(points), tuple(effects), frames, index, volume, extra)
+        self.cache[key] = envelope
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return envelope
+
+
+class Sequencer:
+    """ interpreter for the sequence data of the Namco sound drivers. The ROM is converted to bytes once, opcodes are
+    decoded through the driver's command table (see command_table) and the decoded instructions are cached by address
+    as jumps and repeats keep coming back to the same code """
+
+    def __init__(self, rom, commands):
+        self.source = rom
+        self.rom = bytes(rom)
+        self.commands = commands
+        self.cache = {}
+        self.envelopes = EnvelopeCompiler(self.rom)
+
+    def decode(self, addr):
+        """ (handler, opcode, arguments, address of the next instruction) """
+        rom = self.rom
+        op = rom[addr]
+        handler, arg_format = self.commands[op]
+        args = []
+        offset = addr + 1
+        for arg in arg_format:
+            if arg == 'b':
+                args.append(rom[offset])
+                offset += 1
+            else:
+                # big endian address
+                args.append(int.from_bytes(rom[offset:offset + 2], byteorder='big'))
+                offset += 2
+        return handler, op, tuple(args), offset
+
+    def fetch(self, addr):
+        instruction = self.cache.get(addr)
+        if instruction is None:
+            instruction = self.decode(addr)
+            self.cache[addr] = instruction
+        return instruction
+
+    def step(self, track):
+        """ execute the instruction at the track's address, True when the track has ended """
+        handler, op, args, track.addr = self.fetch(track.addr)
+        return handler(track, op, args)
+
+    def advance(self, track, timestamp_max=None, states=None):
+        """ execute the commands up to the next note and play it (see Track.tick). True once the track has stopped: at
+        its end (track.ended is set), at its loop or past timestamp_max. With states, a dict, the loop of the track is
+        detected: the state of the track is kept before each command and once a state comes back the track stops with
+        track.loop set to (start, length) in frames """
+        fetch = self.fetch
+        while track.duration == 0:
+            if states is not None:
+                state = track.state()
+                start = states.get(state)
+                if start is not None and start < track.timestamp:
+                    track.loop = (start, track.timestamp - start)
+                    return True
+                states[state] = track.timestamp
+            handler, op, args, track.addr = fetch(track.addr)
+            if handler(track, op, args):
+                track.ended = True
+                return True
+        track.tick(timestamp_max)
+        return timestamp_max is not None and track.timestamp > timestamp_max
+
+    def run(self, track, timestamp_max=None, states=None):
+        """ the common driver loop: a track on its own is advanced until it stops. run can be called again to go on
+        after a loop """
+        while not self.advance(track, timestamp_max, states):
+            pass
+
+    def schedule(self, tracks, timestamp_max=None, detect_loops=False):
+        """ run the tracks of a song side by side: a priority queue holds the time each track wakes up at, the track due
+        first (the lowest number at the same time) is advanced by a note and queued again. The first track to end ends
+        the song, the others stop there instead of being played on. With detect_loops the loop of each track is
+        detected as in advance. Returns the end of the song, timestamp_max unless a track ended before """
+        states = [{} if detect_loops else None for track in tracks]
+        queue = [(track.timestamp, num) for num, track in enumerate(tracks)]
+        heapq.heapify(queue)
+        while queue:
+            timestamp, num = heapq.heappop(queue)
+            if timestamp_max is not None and timestamp > timestamp_max:
+                continue
+            track = tracks[num]
+            if not self.advance(track, timestamp_max, states[num]):
+                heapq.heappush(queue, (track.timestamp, num))
+            elif track.ended and (timestamp_max is None or track.timestamp < timestamp_max):
+                timestamp_max = track.timestamp
+        return timestamp_max
+
+
+def command_table(commands, note, note_end, unknown):
+    """ 256 entry dispatch table of (handler, argument format), the format lists the arguments following the opcode:
+    'b' for a byte and 'w' for a big endian word. Opcodes below note_end are notes, the remaining ones not in commands
+    go to unknown """
+    table = []
+    for op in range(256):
+        if op in commands:
+            table.append(commands[op])
+        elif op < note_end:
+            table.append(note)
+        else:
+            table.append((unknown, ''))
+    return table
+
+
+class Track:
+    """ state of a track while its sequence is interpreted. Driver specific subclasses implement the command handlers,
+    called as handler(track, opcode, arguments) and returning True at the end of the track, and have to define
+    tick(timestamp_max=None), which plays the current note with its volume envelope (compiled by the sequencer's
+    envelopes, see EnvelopeCompiler) up to the end of the note or to the first frame past timestamp_max. state_fields
+    names the attributes that make up the state of a track for the loop detection, everything but the timestamp that
+    decides what the track does next """
+    state_fields = ()
+
+    def __init__(self, rom, addr, events):
+        self.rom = rom
+        self.addr = addr
+        self.events = events
+        self.timestamp = 0
+        self.duration = 0
+        self.ended = False
+        self.loop = None
+        self.prev_volume = 0
+        self.current_volume = 0
+
+    def frames(self, timestamp_max=None):
+        """ frames of the note to play, at least one """
+        if timestamp_max is None:
+            return self.duration
+        return min(self.duration, max(1, timestamp_max + 1 - self.timestamp))
+
+    def play(self, envelope):
+        """ write the volume changes of a compiled envelope and advance the track by its frames """
+        for tick, volume in envelope.points:
+            if volume != self.prev_volume:
+                self.events.Volume(self.timestamp + tick, volume)
+                self.prev_volume = volume
+        self.current_volume = envelope.volume
+        self.timestamp += envelope.frames
+        self.duration -= envelope.frames
+
+    def state(self):
+        return tuple(getattr(self, name) for name in self.state_fields)
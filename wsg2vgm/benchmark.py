@@ -0,0 +1,510 @@
+import WSGDrivers
+import WSGRender
+import WSG
+import VGM
+import WSGProfile
+import wsg2vgm
+import numpy as np
+import argparse
+import gzip
+import json
+import platform
+import random
+import sys
+import time
+
+# pipeline stages timed for each driver, rows is the building of the timeline (see WSG.Timeline)
+STAGES = ['parse', 'rows', 'emit', 'data_block', 'gzip', 'render']
+
+
+class SyntheticRom:
+    """ 64K ROM image the synthetic songs are assembled into, data is allocated from 0x2000 on """
+
+    def __init__(self, rng):
+        self.data = bytearray(2 ** 16)
+        self.ptr = 0x2000
+        self.rng = rng
+
+    def alloc(self, length):
+        addr = self.ptr
+        self.ptr += length
+        if self.ptr >= 0xD000:
+            raise Exception('Synthetic ROM full!')
+        return addr
+
+    def put(self, addr, data):
+        self.data[addr:addr + len(data)] = bytes(data)
+
+    def put_word_b(self, addr, value):
+        self.put(addr, [value >> 8, value & 0xFF])
+
+    def put_word_l(self, addr, value):
+        self.put(addr, [value & 0xFF, value >> 8])
+
+    def notes_table(self, width, count=16):
+        addr = self.alloc(width * count)
+        for n in range(count):
+            self.put(addr + n * width, self.rng.randrange(1 << 15, 1 << 18).to_bytes(width, 'big'))
+        return addr
+
+    def envelope(self, slide, end, arg_end=(), effects=(), restart=None):
+        """ volumes and slides closed by one of the end commands. The commands of arg_end take a volume and the
+        envelope goes on after them, so they are followed by one of the other end commands. effects are commands taking
+        a byte that are mixed in, also ahead of the first volume. An envelope with effects isn't closed by restart (the
+        command going back to the start), which would read an effect as a volume or apply the effects every pass """
+        env = []
+        mixed = False
+        if effects and self.rng.random() < 0.3:
+            env += [self.rng.choice(effects), self.rng.randrange(256)]
+            mixed = True
+        env.append(self.rng.randrange(16))
+        for i in range(self.rng.randrange(0, 6)):
+            p = self.rng.random()
+            if p < 0.2 and effects:
+                env += [self.rng.choice(effects), self.rng.randrange(256)]
+                mixed = True
+            elif p < 0.6:
+                env.append(self.rng.randrange(16))
+            else:
+                env += [slide, self.rng.randrange(16)]
+        env.append(self.rng.choice([command for command in end if not mixed or command != restart]))
+        if env[-1] in arg_end:
+            env.append(self.rng.randrange(16))
+            env.append(self.rng.choice([command for command in end if command not in arg_end]))
+        addr = self.alloc(len(env))
+        self.put(addr, env)
+        return addr
+
+    def program(self, note, ops, loop_back=False):
+        """ blocks of notes and commands closed by a repeat, a conditional or an unconditional jump, see the ops of
+        the drivers below """
+        rng = self.rng
+        base = self.alloc(600)
+        code = []
+        for i in range(rng.randrange(1, 5)):
+            block = base + len(code)
+            for j in range(rng.randrange(1, 8)):
+                p = rng.random()
+                if p < 0.12:
+                    code += [ops['wave'], rng.randrange(8) << 4]
+                elif p < 0.2:
+                    code += [ops['env'], rng.randrange(ops['env_count'])]
+                elif p < 0.25 and 'mult' in ops:
+                    code += [ops['mult'], rng.randrange(1, 4)]
+                else:
+                    code += note()
+            code += note()
+            kind = rng.random()
+            if kind < 0.4:
+                code += [ops['repeat'], rng.randrange(1, 4), block >> 8, block & 0xFF]
+            elif kind < 0.5:
+                target = base + len(code) + 4 + 2
+                code += [ops['skip'], rng.randrange(1, 3), target >> 8, target & 0xFF] + note()
+            elif kind < 0.6:
+                target = base + len(code) + 3 + 3
+                code += [ops['jump'], target >> 8, target & 0xFF, 0xFF, 0xFF, 0xFF]
+        if loop_back:
+            code += [ops['jump'], base >> 8, base & 0xFF]
+        else:
+            code += [ops['end']]
+        self.put(base, code)
+        return base
+
+    def wavetable(self):
+        return np.array([[self.rng.randrange(16) for i in range(32)] for j in range(8)], dtype=np.uint8)
+
+
+def synthetic_ponpoko(rom, songs):
+    rng = rom.rng
+    songs_table, waves_table = 0x1000, 0x1100
+    for song_nr in range(songs):
+        song_addr = rom.alloc(6)
+        rom.put_word_l(songs_table + song_nr * 2, song_addr)
+        waves_addr = rom.alloc(3)
+        rom.put_word_l(waves_table + song_nr * 2, waves_addr)
+        rom.put(waves_addr, [rng.randrange(8) for i in range(3)])
+        for track_nr in range(3):
+            events = []
+            for i in range(rng.randrange(40)):
+                events += [rng.randrange(0xFF), rng.randrange(16)]
+                events += [rng.randrange(16) for j in range(4 if track_nr == 0 else 3)]
+            events.append(0xFF)
+            track_addr = rom.alloc(len(events))
+            rom.put(track_addr, events)
+            rom.put_word_l(song_addr + track_nr * 2, track_addr)
+    return dict(songs_table=hex(songs_table), waves_table=hex(waves_table)), rom.wavetable()
+
+
+def synthetic_superpacm(rom, songs, phozon=False):
+    rng = rom.rng
+    song_offsets, songs_table, notes_table, waves_table = 0x1000, 0x1100, 0x1200, 0x1300
+    note_tuning, decay, sustain, attack, attack_env = 0x1400, 0x1500, 0x1600, 0x1700, 0x1800
+    notes = [rom.notes_table(4) for i in range(3)]
+    for n, addr in enumerate(notes):
+        rom.put_word_b(notes_table + n * 2, addr)
+    if phozon:
+        # phozon points straight at the notes
+        notes_table = notes[0]
+    for n in range(4):
+        addr = rom.alloc(20)
+        rom.put(addr, [rng.randrange(16) for i in range(20)])
+        rom.put_word_b(attack_env + n * 2, addr)
+    offset = 0
+    for song_nr in range(songs):
+        tracks = rng.randrange(1, 5)
+        rom.put(song_offsets + song_nr * 4, [offset, 0, tracks, 0])
+        for track_nr in range(offset, offset + tracks):
+            events = []
+            for i in range(rng.randrange(30)):
+                events += [rng.choice([rng.randrange(0xC0), 0xC0 | rng.randrange(16)]), rng.randrange(30)]
+            events.append(0xFF)
+            track_addr = rom.alloc(len(events))
+            rom.put(track_addr, events)
+            rom.put_word_b(songs_table + track_nr * 2, track_addr)
+            rom.data[note_tuning + track_nr] = rng.randrange(3)
+            rom.data[waves_table + track_nr] = rng.randrange(8) << 4
+            rom.data[sustain + track_nr] = rng.randrange(8)
+            rom.data[decay + track_nr] = rng.randrange(12)
+            rom.data[attack + track_nr] = rng.randrange(4)
+        offset += tracks
+    return dict(songs_table=hex(songs_table), notes_table=hex(notes_table), song_offsets=hex(song_offsets),
+                waves_table=hex(waves_table), note_tuning=hex(note_tuning), decay=hex(decay), sustain=hex(sustain),
+                attack=hex(attack), attack_env=hex(attack_env)), rom.wavetable()
+
+
+def synthetic_phozon(rom, songs):
+    return synthetic_superpacm(rom, songs, phozon=True)
+
+
+def synthetic_grobda(rom, songs):
+    rng = rom.rng
+    songs_table, notes_table, volenv_table, dur_multiplier = 0x1000, 0x1100, 0x1200, 0x1300
+    for n in range(3):
+        rom.put_word_b(notes_table + n * 2, rom.notes_table(3))
+    for n in range(6):
+        rom.put_word_b(volenv_table + n * 2, rom.envelope(0x16, [0x10, 0x12, 0x14]))
+    ops = dict(wave=0xF1, env=0xF2, env_count=6, repeat=0xF3, skip=rng.choice([0xF5, 0xF6]), jump=0xF7, end=0xF0)
+
+    def note():
+        return [rng.choice([rng.randrange(0xC0), 0xC0 | rng.randrange(16), rng.randrange(0xD0, 0xF0)]),
+                rng.randrange(1, 20)]
+
+    for song_nr in range(songs):
+        tracks = rng.randrange(1, 5)
+        track_list = rom.alloc(tracks * 3 + 1)
+        for track_nr in range(tracks):
+            program = rom.program(note, ops)
+            header = rom.alloc(5)
+            rom.put(header, [rng.randrange(8) << 4, rng.randrange(6), 0xF7, program >> 8, program & 0xFF])
+            rom.put(track_list + track_nr * 3, [header >> 8, header & 0xFF, rng.randrange(3)])
+        rom.data[track_list + tracks * 3] = 0x11
+        rom.put_word_b(songs_table + song_nr * 2, track_list)
+        rom.data[dur_multiplier + song_nr] = rng.randrange(1, 4)
+    return dict(songs_table=hex(songs_table), notes_table=hex(notes_table), volenv_table=hex(volenv_table),
+                dur_multiplier=hex(dur_multiplier)), rom.wavetable()
+
+
+def synthetic_mappy(rom, songs):
+    rng = rom.rng
+    songs_table, notes_table, volenv_table, dur_multiplier = 0x1000, 0x1100, 0x1200, 0x1300
+    for n in range(3):
+        rom.put_word_b(notes_table + n * 2, rom.notes_table(4))
+    for n in range(6):
+        rom.put_word_b(volenv_table + n * 2, rom.envelope(0x50, [0x10, 0x20, 0x30, 0x40]))
+
+    for song_nr in range(songs):
+        patterns = rng.randrange(1, 4)
+        pattern_list = rom.alloc(patterns * 2 + 1)
+        tracks = rng.randrange(1, 4)
+        for pattern_nr in range(patterns):
+            track_list = rom.alloc(tracks * 3 + 1)
+            for track_nr in range(rng.randrange(1, tracks + 1)):
+                code = [rng.randrange(8) << 4, rng.randrange(6)]
+                for i in range(rng.randrange(12)):
+                    p = rng.random()
+                    if p < 0.1:
+                        code += [0xF0, rng.randrange(3)]
+                    elif p < 0.2:
+                        code += [0xF1, rng.randrange(8) << 4]
+                    elif p < 0.3:
+                        code += [0xF2, rng.randrange(6)]
+                    else:
+                        code += [rng.choice([rng.randrange(0xF0), 0]), rng.randrange(1, 16)]
+                code += [0xF3, 0]
+                addr = rom.alloc(len(code))
+                rom.put(addr, code)
+                rom.put(track_list + track_nr * 3, [addr >> 8, addr & 0xFF, rng.randrange(3)])
+                rom.data[track_list + track_nr * 3 + 3] = 0x11
+            rom.put_word_b(pattern_list + pattern_nr * 2, track_list)
+        rom.data[pattern_list + patterns * 2] = 0x11
+        rom.put_word_b(songs_table + song_nr * 2, pattern_list)
+        rom.data[dur_multiplier + song_nr] = rng.randrange(1, 4)
+    return dict(songs_table=hex(songs_table), notes_table=hex(notes_table), volenv_table=hex(volenv_table),
+                dur_multiplier=hex(dur_multiplier)), rom.wavetable()
+
+
+def synthetic_todruaga(rom, songs):
+    rng = rom.rng
+    songs_table, notes_table, volenv_table = 0x1000, 0x1100, 0x1200
+    for n in range(3):
+        rom.put_word_b(notes_table + n * 2, rom.notes_table(3))
+    for n in range(6):
+        rom.put_word_b(volenv_table + n * 2, rom.envelope(0x11, [0x10, 0x12, 0x13, 0x14], [0x14]))
+    ops = dict(wave=0xF0, env=0xF1, env_count=6, mult=0xF2, repeat=0xF4, skip=0xF5, jump=0xF6, end=0xF3)
+
+    def note():
+        return [rng.randrange(0xF0), rng.randrange(1, 20)]
+
+    for song_nr in range(songs):
+        tracks = rng.randrange(1, 5)
+        track_list = rom.alloc(tracks * 3 + 1)
+        # endless songs run up to the loop end
+        loop_back = rng.random() < 0.4
+        for track_nr in range(tracks):
+            program = rom.program(note, ops, loop_back)
+            header = rom.alloc(7)
+            rom.put(header, [0xF0, rng.randrange(8) << 4, 0xF1, rng.randrange(6), 0xF6, program >> 8, program & 0xFF])
+            rom.put(track_list + track_nr * 3, [header >> 8, header & 0xFF, rng.randrange(3)])
+        rom.data[track_list + tracks * 3] = 0xE0
+        rom.put_word_b(songs_table + song_nr * 2, track_list)
+    return dict(songs_table=hex(songs_table), notes_table=hex(notes_table), volenv_table=hex(volenv_table),
+                volenv_total=6), rom.wavetable()
+
+
+def synthetic_skykid(rom, songs):
+    rng = rom.rng
+    data_address, notes_table = 0x1000, 0x1600
+    wavetable, songs_table, volenv_table, dur_multiplier = 0x1100, 0x1300, 0x1400, 0x1500
+    for offset, addr in ((0, wavetable), (4, songs_table), (6, volenv_table), (14, dur_multiplier)):
+        rom.put_word_b(data_address + offset, addr)
+    rom.put(wavetable, [rng.randrange(256) for i in range(256)])
+    for n in range(32):
+        rom.put(notes_table + n * 3, rng.randrange(1 << 15, 1 << 18).to_bytes(3, 'big'))
+    for n in range(14):
+        # 0x1C changes the wave and 0x1E bends the pitch while the note plays
+        rom.put_word_b(volenv_table + n * 2, rom.envelope(0x16, [0x10, 0x12, 0x14], effects=[0x1C, 0x1E],
+                                                          restart=0x14))
+    # the envelopes of the notes without duration, which play on to the end of the song or only apply the effects
+    # their envelope starts with. The fade out (0x12) counts down the frames left and isn't used
+    first, second = rng.sample([0x1C, 0x1E], 2)
+    envelopes = [[first, rng.randrange(256), second, rng.randrange(256), rng.randrange(16), 0x10],
+                 [rng.randrange(16), 0x16, rng.randrange(16), 0x10]]
+    for n, envelope in enumerate(envelopes, 14):
+        addr = rom.alloc(len(envelope))
+        rom.put(addr, envelope)
+        rom.put_word_b(volenv_table + n * 2, addr)
+
+    def note():
+        if rng.random() < 0.03:
+            return [0xE3, rng.choice([14, 15]), rng.choice([rng.randrange(0xC0), 0xC0 | rng.randrange(16)]), 0]
+        return [rng.choice([rng.randrange(0xC0), 0xC0 | rng.randrange(16)]), rng.randrange(1, 40)]
+
+    for song_nr in range(songs):
+        tracks = rng.randrange(1, 5)
+        track_list = rom.alloc(tracks * 6 + 1)
+        rom.data[dur_multiplier + song_nr] = rng.randrange(1, 4)
+        # endless songs run up to the song length
+        loop_back = rng.random() < 0.2
+        for track_nr in range(tracks):
+            base = rom.alloc(400)
+            code = []
+            for i in range(rng.randrange(1, 4)):
+                block = base + len(code)
+                for j in range(rng.randrange(1, 8)):
+                    p = rng.random()
+                    if p < 0.1:
+                        code += [0xE1, rng.randrange(16) << 4]
+                    elif p < 0.15:
+                        code += [0xE3, rng.randrange(8)]
+                    elif p < 0.2:
+                        code += [0xE4, rng.randrange(3)]
+                    elif p < 0.23 and not loop_back:
+                        # the multiplier would keep growing in a loop
+                        code += [0xF1, rng.randrange(1, 3)]
+                    elif p < 0.25:
+                        code += [0xF2]
+                    elif p < 0.28 and track_nr < tracks - 1:
+                        # the following tracks start where this one is at the next 0xF0
+                        code += [0xEF, rng.randrange(1, tracks - track_nr)]
+                    elif p < 0.31:
+                        code += [0xF0]
+                    else:
+                        code += note()
+                code += note()
+                kind = rng.random()
+                if kind < 0.3:
+                    code += [rng.choice([0xE5, 0xE7]), rng.randrange(1, 3), block >> 8, block & 0xFF]
+                elif kind < 0.4:
+                    skipped = note()
+                    target = base + len(code) + 4 + len(skipped)
+                    code += [0xE8, rng.randrange(1, 3), target >> 8, target & 0xFF] + skipped
+                elif kind < 0.5:
+                    target = base + len(code) + 3 + 3
+                    code += [0xE9, target >> 8, target & 0xFF, 0xFF, 0xFF, 0xFF]
+            if loop_back:
+                code += [0xE9, base >> 8, base & 0xFF]
+            else:
+                code.append(0xE0)
+            rom.put(base, code)
+            rom.put(track_list + track_nr * 6, [base >> 8, base & 0xFF, track_nr, rng.randrange(256) & 0x37,
+                                                rng.randrange(16) << 4, rng.randrange(8)])
+        rom.data[track_list + tracks * 6] = 0x11
+        rom.put_word_b(songs_table + song_nr * 2, track_list)
+    # the wavetable is part of the program ROM
+    return dict(data_address=hex(data_address), notes_table=hex(notes_table)), None
+
+
+# synthetic song data by reader of the registered drivers
+synthetic_readers = {
+    'read_ponpoko': synthetic_ponpoko,
+    'read_superpacm': synthetic_superpacm,
+    'read_phozon': synthetic_phozon,
+    'read_grobda': synthetic_grobda,
+    'read_mappy': synthetic_mappy,
+    'read_todruaga': synthetic_todruaga,
+    'read_skykid': synthetic_skykid,
+}
+
+
+def synthetic_reader(driver_name, songs=6, seed=0):
+    """ a loaded Reader for random but valid song data of the driver, no ROM files or json config needed """
+    rom = SyntheticRom(random.Random('%s-%d' % (driver_name, seed)))
+    game, wavetable = synthetic_readers[WSGDrivers.get_driver(driver_name).reader](rom, songs)
+    game.update(driver=driver_name, songs_total=songs)
+
+    file_reader = WSGDrivers.Reader(driver_name)
+    file_reader.get_game_info(game)
+    file_reader.rom = np.frombuffer(bytes(rom.data), dtype=np.uint8)
+    file_reader.wavetable = wavetable
+    file_reader.loaded = True
+    return file_reader
+
+
+def benchmark_game(file_reader, render=True):
+    """ seconds spent in each stage for all songs of the game, the number of events and the VGM bytes. The stages
+    follow the pipeline of wsg2vgm.convert: rows builds the timeline of the parsed song, data_block the sample bank
+    and emit writes the commands, its time taken from the conversion's own instrumentation as the conversion is given
+    the timeline and the bank. A song that fails is reported in failed (song number and error) and left out of the
+    times, the other songs are still timed """
+    times = dict.fromkeys(STAGES, 0.0)
+    counts = dict(songs=0, events=0, vgm_bytes=0, errors=0, failed=[])
+    chip = VGM.C352()
+
+    for song_nr in range(file_reader.total_songs):
+        song_times = dict.fromkeys(STAGES, 0.0)
+        try:
+            start = time.perf_counter()
+            tracks = file_reader.read(song_nr)
+            song_times['parse'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            timeline = WSG.Timeline(tracks)
+            song_times['rows'] = time.perf_counter() - start
+            timeline.loop = file_reader.loop
+
+            start = time.perf_counter()
+            instruments, wavetable = wsg2vgm.scan_instruments(timeline, [False] * timeline.channels, chip)
+            sample_bank = VGM.SampleBank()
+            wsg2vgm.add_instruments(sample_bank, instruments, wavetable)
+            chip.DataBlock.FromBuffer(sample_bank.Data())
+            song_times['data_block'] = time.perf_counter() - start
+
+            profile = WSGProfile.enable()
+            try:
+                vgm_data = wsg2vgm.convert(file_reader, song_nr, sample_bank=sample_bank, timeline=timeline)[1]
+            finally:
+                WSGProfile.disable()
+            song_times['emit'] = profile.Record(WSGProfile.EMIT)['seconds']
+
+            start = time.perf_counter()
+            gzip.compress(vgm_data)
+            song_times['gzip'] = time.perf_counter() - start
+
+            if render:
+                start = time.perf_counter()
+                for buffer in WSGRender.Renderer().Stream(timeline.Rows()):
+                    pass
+                song_times['render'] = time.perf_counter() - start
+        except Exception as e:
+            print('%s song %d failed: %s' % (file_reader.game_name, song_nr, e))
+            counts['errors'] += 1
+            counts['failed'].append([song_nr, str(e)])
+            continue
+
+        for stage in STAGES:
+            times[stage] += song_times[stage]
+        counts['songs'] += 1
+        counts['events'] += sum(len(track) for track in tracks)
+        counts['vgm_bytes'] += len(vgm_data)
+
+    return times, counts
+
+
+def run(games, synthetic=True, songs=6, repeat=3, render=True):
+    """ the best time of repeat runs for each game and stage """
+    results = {}
+    for game_name in games:
+        best = None
+        for i in range(repeat):
+            file_reader = synthetic_reader(game_name, songs) if synthetic else WSGDrivers.Reader(game_name)
+            times, counts = benchmark_game(file_reader, render)
+            best = times if best is None else {stage: min(best[stage], times[stage]) for stage in STAGES}
+        results[game_name] = dict(seconds=best, **counts)
+        print('%-10s ' % game_name + ' '.join('%s %.4f' % (stage, best[stage]) for stage in STAGES))
+    return results
+
+
+def compare(results, baseline, threshold=0.2, min_seconds=0.001):
+    """ the stages slower than the baseline by more than threshold, stages faster than min_seconds in both are
+    ignored as noise """
+    regressions = []
+    for game_name, result in results.items():
+        base = baseline.get('games', {}).get(game_name)
+        if base is None:
+            continue
+        for stage in STAGES:
+            seconds = result['seconds'].get(stage, 0)
+            base_seconds = base['seconds'].get(stage, 0)
+            if max(seconds, base_seconds) < min_seconds:
+                continue
+            if seconds > base_seconds * (1 + threshold):
+                regressions.append((game_name, stage, base_seconds, seconds))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark the conversion stages of each driver')
+
+    parser.add_argument('games', nargs='*', help='drivers to benchmark with synthetic songs (default all), or game '
+                                                 'names with --roms')
+    parser.add_argument("--roms", action='store_true', help='use the configured games and their ROM files')
+    parser.add_argument("--songs", type=int, default=6, help='synthetic songs per driver')
+    parser.add_argument("--repeat", "-r", type=int, default=3, help='runs per game, the best time is kept')
+    parser.add_argument("--no-render", action='store_true', help='skip the audio rendering')
+    parser.add_argument("--output", "-o", default='benchmark.json', help='results file')
+    parser.add_argument("--baseline", "-b", help='results file to compare against')
+    parser.add_argument("--threshold", "-t", type=float, default=0.2,
+                        help='relative slowdown reported as a regression')
+
+    args = parser.parse_args()
+
+    if args.roms:
+        games = args.games or WSGDrivers.Reader.game_names()
+    else:
+        games = args.games or [name for name, driver in WSGDrivers.drivers.items()
+                               if driver.reader in synthetic_readers]
+
+    results = run(games, not args.roms, args.songs, args.repeat, not args.no_render)
+    with open(args.output, 'w') as f:
+        json.dump(dict(python=platform.python_version(), numpy=np.__version__, synthetic=not args.roms,
+                       games=results), f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for game_name, stage, base_seconds, seconds in regressions:
+            print('%s %s: %.4f s -> %.4f s (%+.0f%%)' % (game_name, stage, base_seconds, seconds,
+                                                        (seconds / base_seconds - 1) * 100 if base_seconds else 100))
+        if regressions:
+            sys.exit(1)
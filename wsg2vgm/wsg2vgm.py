@@ -1,197 +1,523 @@
 import WSGDrivers
+import WSG
 import VGM
-import json
+import WSGLog
+import WSGProfile
 import numpy as np
 import argparse
-import ntpath
+import cProfile
 import gzip
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+def read_timeline(file_reader, song_nr):
+    """ merged event stream of a song """
+    tracks = file_reader.read(song_nr)
+    with WSGProfile.stage(WSGProfile.ROWS):
+        timeline = WSG.Timeline(tracks)
+    timeline.loop = file_reader.loop
+    # songs can be followed by another one (e.g. todruaga song 31 + 26)
+    # with an empty frame in between
+    append_song = file_reader.song_info(song_nr).get('append_song')
+    if append_song is not None:
+        tracks = file_reader.read(append_song)
+        with WSGProfile.stage(WSGProfile.ROWS):
+            timeline.Append(tracks, gap=1)
+        # the loop found covers the first song only
+        timeline.loop = None
+    return timeline
+
+
+def song_filename(file_reader, song_nr, extension='.vgz'):
+    title = file_reader.song_info(song_nr).get('song_title', '')
+    return '{:02d} {:s}{:s}'.format(song_nr, title.replace(':', ' -'), extension)
+
+
+def scan_instruments(timeline, track_mute, chip):
+    """ the instruments (order << 4 | wave) in the order convert first uses them and the song's wavetable, so that the
+    data block can be written ahead of the commands """
+    channel_len = timeline.channels
+    register_size = [0] * channel_len
+    wave = [-1] * channel_len
+    instruments = {}
+    wavetable = None
+    pitches = VGM.GetPitchTable(chip)
+
+    for frame, track_nr, (code, timestamp, value, duration) in timeline:
+        if not track_mute[track_nr]:
+            instrument = None
+            if code == WSG.NOTE and value:
+                freq_div, order, overflow = pitches.Pitch(value, sample_rate, register_size[track_nr])
+                instrument = (order << 4) | (wave[track_nr] & 0xF)
+            elif code == WSG.WAVE:
+                instrument = value
+            if instrument is not None:
+                instruments[instrument] = None
+                wave[track_nr] = instrument
+        if code == WSG.SAMPLE_RATE:
+            sample_rate = value
+        elif code == WSG.REGISTER_SIZE:
+            register_size[track_nr] = value
+        elif code == WSG.WAVETABLE:
+            wavetable = value
+
+    return list(instruments), wavetable
+
+
+def add_instruments(sample_bank, instruments, wavetable):
+    """ allocate the samples of the instruments, the wave of an instrument is downsampled by its order so that high
+    notes stay in the frequency range of the chip """
+    instruments = [instrument for instrument in instruments if instrument not in sample_bank]
+    if not instruments:
+        return
+    wavetable = wavetable.copy()
+    wavetable <<= 4
+    wavetable = wavetable.astype('int8')
+    wavetable -= 128
+    for instrument in instruments:
+        sample_bank.Add(instrument, wavetable[instrument & 0x0F][::2 ** (instrument >> 4)].tobytes())
+
+
+def read_pack(game_name, file_reader, chip_name='c352'):
+    """ read all songs of a game for a pack and build one sample bank from them, so that every song of the pack uses
+    the same slots. Returns the bank and the timelines by song number for the conversion, a song that can't be read is
+    reported and left out. Solo settings are ignored, the bank holds the instruments of all tracks """
+    sample_bank = VGM.SampleBank()
+    chip = VGM.chips[chip_name]()
+    timelines = {}
+    for song_nr in range(file_reader.total_songs):
+        try:
+            timeline = read_timeline(file_reader, song_nr)
+        except Exception as e:
+            print('%s song %d failed: %s' % (game_name, song_nr, e))
+            continue
+        instruments, wavetable = scan_instruments(timeline, [False] * timeline.channels, chip)
+        add_instruments(sample_bank, instruments, wavetable)
+        timelines[song_nr] = timeline
+    return sample_bank, timelines
+
+
+def convert(file_reader, song_nr, solo=None, output=None, optimize=False, sample_bank=None, chip_name='c352',
+            timeline=None):
+    """ convert a song of an already loaded game, returns the output file name and the VGM data. With output, a
+    seekable binary file, the VGM is written there while the song is converted and no data is returned. optimize drops
+    the redundant register writes and packs the delays (see VGM.C352Optimizer). A sample_bank passed in is extended by
+    the song's instruments and can be reused for the following songs. chip_name selects the chip in VGM.chips. The
+    song is read unless its timeline is given """
+    if timeline is None:
+        timeline = read_timeline(file_reader, song_nr)
+
+    song_loop = False
+    loop_offset = 0
+
+    # info data
+    gd3 = VGM.GD3()
+
+    game_info = file_reader.game_info
+    if game_info:
+        gd3.author = game_info.get('author', '')
+        gd3.game_name = game_info.get('game_title', '')
+        gd3.system_name = game_info.get('platform', '')
+        gd3.vgm_author = game_info.get('vgm_author', '')
+        gd3.notes = game_info.get('notes', '')
+        gd3.date = game_info.get('date', '')
+
+    song = file_reader.song_info(song_nr)
+    if song:
+        gd3.author = song.get('author', gd3.author)
+        gd3.track_name = song.get('song_title', '')
+        song_loop = song.get('loop', False)
+        loop_offset = song.get('loop_offset', 0)
+    if timeline.loop:
+        song_loop = True
+        loop_offset = timeline.loop[0]
+
+    vgm_writer = writer = VGM.Writer(output)
+    if optimize:
+        writer = VGM.C352Optimizer(writer)
+    chip = VGM.chips[chip_name](writer=writer)
+    pitches = VGM.GetPitchTable(chip)
+
+    channel_len = timeline.channels
+    noteoff_timestamp = [-1] * channel_len
+    register_size = [0] * channel_len
+    track_mute = [False] * channel_len
+    wave = [-1] * channel_len
+
+    rate_frame = 0
+
+    if solo:
+        track_mute = [True] * channel_len
+        for solo_track in solo:
+            if solo_track < len(track_mute):
+                track_mute[solo_track] = False
+
+    stage = WSGProfile.begin(WSGProfile.DATA_BLOCK)
+    instruments, wavetable = scan_instruments(timeline, track_mute, chip)
+
+    # data block
+    # extract samples and resample if exceeding the freq range
+    if sample_bank is None:
+        sample_bank = VGM.SampleBank()
+    add_instruments(sample_bank, instruments, wavetable)
+    data_block = chip.DataBlock.FromBuffer(sample_bank.Data())
+    WSGProfile.count(WSGProfile.DATA_BLOCK, len(instruments), len(data_block))
+    WSGProfile.end(stage)
+    stage = WSGProfile.begin(WSGProfile.EMIT)
+
+    # vgm header, the offsets are filled in once the song is written
+    header = VGM.Header()
+    header.ChipParams(chip.Params())
+    writer.Begin(header, data_block)
+
+    # the loop starts at the beginning unless the loop frame is reached
+    loop_start = 0
+    if song_loop:
+        writer.MarkLoop()
+
+    # only the frames with events, note offs or the loop point are visited, the frames in between are one delay
+    events = iter(timeline)
+    event = next(events, None)
+    last_frame = len(timeline) - 1
+    timestamp = 0
+
+    while timestamp <= last_frame:
 
-
-def timestamp_max(tracks):
-    value = 0
-
-    for track in tracks:
-        for event in reversed(track):
-            if event.__class__.__name__ == 'Note':
-                value = max(value, event.timestamp + event.duration)
-                break
-    return value
-
-
-def tracks2rows(tracks):
-
-    tmax = timestamp_max(tracks)
-    rows = [[[] for i in range(len(tracks))] for j in range(tmax)]
-
-    for num, track in enumerate(tracks):
-        for event in track:
-            if event.timestamp < tmax:
-                rows[event.timestamp][num].append(event)
-
-    return rows
-
-
-# Initiate the parser
-parser = argparse.ArgumentParser('Play Namco 15XX sound files')
-
-parser.add_argument('filename')
-parser.add_argument('song_nr', nargs='?', type=int, default=-1)
-parser.add_argument("--solo", "-s", nargs='+', type=int)
-
-args = parser.parse_args()
-
-# read data from rom
-file_reader = WSGDrivers.Reader(args.filename)
-tracks = tracks2rows(file_reader.read(args.song_nr))
-# a special case for todruaga song 31 which combines 31 + 26
-# with an empty frame in between
-if args.filename == 'todruaga' and args.song_nr == 31:
-    tracks.append([[], [], [], []])
-    tracks_add = tracks2rows(file_reader.read(26))
-    for row in tracks_add:
-        tracks.append(row)
-
-song_loop = False
-loop_offset = 0
-loop_offset_bytes = 0
-
-# info data
-gd3 = VGM.GD3()
-
-# read config file
-try:
-    with open('json/' + args.filename + '.json') as f:
-        data = json.loads(f.read())
-
-        game_info = data.get('game_info')
-        if game_info:
-            gd3.author = game_info.get('author', '')
-            gd3.game_name = game_info.get('game_title', '')
-            gd3.system_name = game_info.get('platform', '')
-            gd3.vgm_author = game_info.get('vgm_author', '')
-            gd3.notes = game_info.get('notes', '')
-            gd3.date = game_info.get('date', '')
-
-        songs = data.get('songs')
-        if songs and args.song_nr < len(songs):
-            module_name = songs[args.song_nr].get('song_title', '')
-            gd3.author = songs[args.song_nr].get('author', gd3.author)
-            gd3.track_name = songs[args.song_nr].get('song_title', '')
-            song_loop = songs[args.song_nr].get('loop', False)
-            loop_offset = songs[args.song_nr].get('loop_offset', 0)
-
-except IOError:
-    pass
-
-chip = VGM.C352()
-
-channel_len = len(tracks[0])
-noteoff_timestamp = [-1] * channel_len
-register_size = [0] * channel_len
-track_mute = [False] * channel_len
-wave = [-1] * channel_len
-song_data = bytes()
-data_block = bytes()
-
-frame_dt = 0
-
-if args.solo:
-    track_mute = [True] * channel_len
-    for solo_track in args.solo:
-        if solo_track < len(track_mute):
-            track_mute[solo_track] = False
-
-instrument_table = []
-instrument_length = [0]
-
-for timestamp, row in enumerate(tracks):
-
-    if song_loop and loop_offset == timestamp:
-        loop_offset_bytes = len(song_data)
-
-    song_length = len(song_data)
-    for track_nr, track in enumerate(row):
-        # key offs for the looped tunes
         if song_loop and loop_offset == timestamp:
-            song_data += chip.KeyOff(track_nr)
-        if noteoff_timestamp[track_nr] == timestamp:
-            song_data += chip.KeyOff(track_nr)
-
-        for event in track:
-            event_name = event.__class__.__name__
-            if not track_mute[track_nr]:
-                if event_name == 'Note' and event.value:
-                    note_freq = float(event.value) * sample_rate / (2 ** register_size[track_nr])
-                    # handle high pitch notes
-                    freq_div = round(note_freq * 2 ** 21 / chip.clock_rate)
-                    order = max(freq_div.bit_length() - 16, 0)
-                    note_freq = note_freq / (2 ** order)
-                    current_wave = (order << 4) | (wave[track_nr] & 0xF)
-                    if current_wave not in instrument_table:
-                        instrument_table.append(current_wave)
-                        instrument_length.append(instrument_length[-1] + 2 ** (5 - order))
-                    if current_wave != wave[track_nr]:
-                        wave[track_nr] = current_wave
-                        instr = instrument_table.index(current_wave)
-                        song_data += chip.Wave(track_nr, instrument_length[instr], instrument_length[instr+1]-1)
-                    song_data += chip.FreqHz(track_nr, note_freq)
-                    song_data += chip.KeyOn(track_nr)
-                    noteoff_timestamp[track_nr] = event.timestamp + event.duration
-                elif event_name == 'Wave':
-                    if event.wave not in instrument_table:
-                        instrument_table.append(event.wave)
-                        instrument_length.append(instrument_length[-1] + 2 ** 5)
-                    if event.wave != wave[track_nr]:
-                        wave[track_nr] = event.wave
-                        instr = instrument_table.index(event.wave)
-                        song_data += chip.Wave(track_nr, instrument_length[instr], instrument_length[instr+1]-1)
-                elif event_name == 'Volume':
-                    song_data += chip.Volume(track_nr, event.volume << 4)
-            if event_name == 'SampleRate':
-                sample_rate = event.rate
-            elif event_name == 'FrameRate':
-                delay_rate = 44100 / event.frame_rate
-            elif event_name == 'RegisterSize':
-                register_size[track_nr] = event.size
-            elif event_name == 'Wavetable':
-                wavetable = event.wavetable.copy()
-                wavetable <<= 4
-                wavetable = wavetable.astype('int8')
-                wavetable -= 128
-
-    # clunky, move to the top
-    frame_dt += delay_rate
-    if song_length != len(song_data):
-        song_data += chip.ExecKeys()
-    song_data += chip.Delay(round(frame_dt))
-    frame_dt -= round(frame_dt)
-
-    #switch off all remaning notes
-    if timestamp == len(tracks) - 1:
-        for track_nr, note_off in enumerate(noteoff_timestamp):
-            if note_off >= timestamp:
-                song_data += chip.KeyOff(track_nr)
-        song_data += chip.ExecKeys()
-
-song_data += VGM.EndOfSound()
-
-# data block
-# extract samples and resample if exceeding the freq range
-sample_buffer = np.concatenate([wavetable[inst & 0x0F][::(inst >> 4)+1] for inst in instrument_table])
-data_block = chip.DataBlock.FromBuffer(sample_buffer.tobytes())
-
-# vgm header
-header = VGM.Header()
-header.ChipParams(chip.Params())
-header.GD3Offset(len(header.data) + len(data_block) + len(song_data))
-header.EOFOffset(len(header.data) + len(data_block) + len(song_data) + len(gd3.get_bytes()))
-header.TotalSamples(chip.delay_total)
-
-if song_loop:
-    header.Loop(loop_offset_bytes + len(data_block), chip.delay_total)
-
-vgm_data = header.data + data_block + song_data + gd3.get_bytes()
-
-# write the packed version
-with gzip.open('{:02d} {:s}.vgz'.format(args.song_nr, gd3.track_name.replace(':', ' -')), 'wb') as f:
-    f.write(vgm_data)
+            writer.MarkLoop()
+            loop_start = chip.delay_total
+
+        song_length = len(writer)
+        for track_nr in range(channel_len):
+            # key offs for the looped tunes
+            if song_loop and loop_offset == timestamp:
+                chip.KeyOff(track_nr)
+                # the wave is set again, the voice still has the one of the end of the song when the loop is played
+                if wave[track_nr] >= 0:
+                    bank, start, end = sample_bank.Slot(wave[track_nr])
+                    chip.Wave(track_nr, start, end, wave_bank=bank)
+            if noteoff_timestamp[track_nr] == timestamp:
+                chip.KeyOff(track_nr)
+
+            while event is not None and event[0] == timestamp and event[1] == track_nr:
+                code, event_timestamp, value, duration = event[2]
+                event = next(events, None)
+                if not track_mute[track_nr]:
+                    if code == WSG.NOTE and value:
+                        freq_div, order, overflow = pitches.Pitch(value, sample_rate, register_size[track_nr])
+                        current_wave = (order << 4) | (wave[track_nr] & 0xF)
+                        if current_wave != wave[track_nr]:
+                            wave[track_nr] = current_wave
+                            bank, start, end = sample_bank.Slot(current_wave)
+                            chip.Wave(track_nr, start, end, wave_bank=bank)
+                        chip.FreqDiv(track_nr, freq_div)
+                        chip.overflows += overflow
+                        chip.KeyOn(track_nr)
+                        noteoff_timestamp[track_nr] = event_timestamp + duration
+                    elif code == WSG.WAVE:
+                        if value != wave[track_nr]:
+                            wave[track_nr] = value
+                            bank, start, end = sample_bank.Slot(value)
+                            chip.Wave(track_nr, start, end, wave_bank=bank)
+                    elif code == WSG.VOLUME:
+                        chip.Volume(track_nr, value << 4)
+                if code == WSG.SAMPLE_RATE:
+                    sample_rate = value
+                elif code == WSG.FRAME_RATE:
+                    delay_rate = 44100 / value
+                    rate_frame = timestamp
+                elif code == WSG.REGISTER_SIZE:
+                    register_size[track_nr] = value
+
+        next_frame = last_frame
+        if event is not None:
+            next_frame = min(next_frame, event[0])
+        for note_off in noteoff_timestamp:
+            if timestamp < note_off < next_frame:
+                next_frame = note_off
+        if song_loop and timestamp < loop_offset < next_frame:
+            next_frame = loop_offset
+        next_frame = max(next_frame, timestamp + 1)
+
+        if song_length != len(writer):
+            chip.ExecKeys()
+        # a frame starts at its time rounded to samples, counted from the frame the rate was set at, so that the gap
+        # up to the next frame is one delay however long it is
+        chip.Delay(round((next_frame - rate_frame) * delay_rate) - round((timestamp - rate_frame) * delay_rate))
+
+        #switch off all remaning notes
+        if timestamp == last_frame:
+            for track_nr, note_off in enumerate(noteoff_timestamp):
+                if note_off >= timestamp:
+                    chip.KeyOff(track_nr)
+            chip.ExecKeys()
+
+        timestamp = next_frame
+
+    writer.EndOfSound()
+    vgm_data = writer.Finish(gd3, chip.delay_total, chip.delay_total - loop_start)
+    WSGProfile.count(WSGProfile.EMIT, size=len(vgm_writer), overflows=chip.overflows)
+    WSGProfile.end(stage)
+
+    return song_filename(file_reader, song_nr), vgm_data
+
+
+def convert_wsg(file_reader, song_nr, solo=None, output=None):
+    """ the song as a log of the WSG registers (see WSGLog) instead of a VGM for another chip, returns the output file
+    name and the log like convert """
+    timeline = read_timeline(file_reader, song_nr)
+    song = file_reader.song_info(song_nr)
+    loop_offset = None
+    if song and song.get('loop', False):
+        loop_offset = song.get('loop_offset', 0)
+    if timeline.loop:
+        loop_offset = timeline.loop[0]
+    with WSGProfile.stage(WSGProfile.EMIT):
+        log = WSGLog.Logger(solo).Log(timeline, output, loop_offset)
+        WSGProfile.count(WSGProfile.EMIT, size=len(log) if log is not None else output.tell())
+    return song_filename(file_reader, song_nr, '.wsgz'), log
+
+
+def write_vgz(filename, vgm_data):
+    # write the packed version
+    with WSGProfile.stage(WSGProfile.COMPRESS):
+        with gzip.open(filename, 'wb') as f:
+            f.write(vgm_data)
+        WSGProfile.count(WSGProfile.COMPRESS, size=os.path.getsize(filename))
+
+
+def write_song(file_reader, song_nr, output_path='', solo=None, stream=False, compress=True, optimize=False,
+               sample_bank=None, chip_name='c352', timeline=None):
+    """ convert a song into output_path. A streamed song is written to a .vgm file while it is converted and, unless
+    compress is False, packed into the .vgz in a second streaming pass. The 'wsg' chip writes a WSG register log
+    (.wsg / .wsgz). A timeline already read is converted instead of reading the song again """
+    if chip_name == 'wsg':
+        filename = os.path.join(output_path, song_filename(file_reader, song_nr, '.wsgz'))
+        vgm_filename = os.path.splitext(filename)[0] + '.wsg'
+    else:
+        filename = os.path.join(output_path, song_filename(file_reader, song_nr))
+        vgm_filename = os.path.splitext(filename)[0] + '.vgm'
+    if not stream:
+        if chip_name == 'wsg':
+            vgm_data = convert_wsg(file_reader, song_nr, solo)[1]
+        else:
+            vgm_data = convert(file_reader, song_nr, solo, optimize=optimize, sample_bank=sample_bank,
+                               chip_name=chip_name, timeline=timeline)[1]
+        if compress:
+            write_vgz(filename, vgm_data)
+        else:
+            with open(vgm_filename, 'wb') as f:
+                f.write(vgm_data)
+        return
+
+    with open(vgm_filename, 'w+b') as f:
+        if chip_name == 'wsg':
+            convert_wsg(file_reader, song_nr, solo, f)
+        else:
+            convert(file_reader, song_nr, solo, f, optimize, sample_bank, chip_name, timeline)
+    if compress:
+        with WSGProfile.stage(WSGProfile.COMPRESS):
+            with open(vgm_filename, 'rb') as f_in, gzip.open(filename, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            WSGProfile.count(WSGProfile.COMPRESS, size=os.path.getsize(filename))
+        os.remove(vgm_filename)
+
+
+def convert_game(game_name, output_path='', solo=None, stream=False, compress=True, optimize=False, pack=False,
+                 chip_name='c352'):
+    """ convert every song of a game, the ROM image and driver tables are loaded only once. In a pack all songs share
+    the game's sample bank """
+    file_reader = WSGDrivers.Reader(game_name)
+    file_reader.load()
+    sample_bank = None
+    timelines = {}
+    if pack and chip_name != 'wsg':
+        sample_bank, timelines = read_pack(game_name, file_reader, chip_name)
+
+    for song_nr in range(file_reader.total_songs):
+        if sample_bank is not None and song_nr not in timelines:
+            # already reported by read_pack
+            continue
+        try:
+            write_song(file_reader, song_nr, output_path, solo, stream, compress, optimize, sample_bank, chip_name,
+                       timelines.pop(song_nr, None))
+        except Exception as e:
+            print('%s song %d failed: %s' % (game_name, song_nr, e))
+
+
+class SharedRom:
+    """ decoded ROM image and wavetable of a game in shared memory, so worker processes don't read the zip again """
+
+    def __init__(self, file_reader):
+        self.wavetable_shape = None
+        self.wavetable_dtype = None
+        size = file_reader.rom.nbytes
+        if file_reader.wavetable is not None:
+            self.wavetable_shape = file_reader.wavetable.shape
+            self.wavetable_dtype = file_reader.wavetable.dtype.str
+            size += file_reader.wavetable.nbytes
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self.memory.name
+        rom, wavetable = self.arrays(self.memory)
+        rom[:] = file_reader.rom
+        if wavetable is not None:
+            wavetable[:] = file_reader.wavetable
+
+    def arrays(self, memory):
+        rom = np.ndarray((2 ** 16,), dtype=np.uint8, buffer=memory.buf)
+        wavetable = None
+        if self.wavetable_shape is not None:
+            wavetable = np.ndarray(self.wavetable_shape, dtype=self.wavetable_dtype, buffer=memory.buf,
+                                   offset=rom.nbytes)
+        return rom, wavetable
+
+    def __getstate__(self):
+        # only the description travels to the workers, they attach to the memory by name
+        state = self.__dict__.copy()
+        del state['memory']
+        return state
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+# readers attached to shared ROM images, one per game and worker process
+shared_readers = {}
+
+
+def convert_shared(game_name, song_nr, output_path, solo, shared_rom, flat_path=None, stream=False, compress=True,
+                   optimize=False, sample_bank=None, chip_name='c352', timeline=None):
+    """ worker side of convert_games_parallel """
+    file_reader = shared_readers.get(game_name)
+    if file_reader is None:
+        file_reader = WSGDrivers.Reader(game_name)
+        if shared_rom:
+            memory = shared_memory.SharedMemory(name=shared_rom.name)
+            file_reader.load(*shared_rom.arrays(memory))
+            file_reader.shared_memory = memory
+        else:
+            # map the flat images the parent has exported, all workers share the page cache
+            WSGDrivers.Reader.flat_path = flat_path
+            file_reader.load()
+        shared_readers[game_name] = file_reader
+
+    write_song(file_reader, song_nr, output_path, solo, stream, compress, optimize, sample_bank, chip_name, timeline)
+
+
+def convert_games_parallel(games, output_path='', solo=None, jobs=None, stream=False, compress=True,
+                           optimize=False, pack=False, chip_name='c352'):
+    """ convert every song of the games on a pool of worker processes. The ROMs are loaded once here and shared with
+    the workers, either in shared memory or, with Reader.flat_path set, as memory mapped flat images. The sequencers
+    run in parallel """
+    flat_path = WSGDrivers.Reader.flat_path
+    shared_roms = []
+    futures = []
+    # the shared memory is released however the conversion ends, e.g. interrupted
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for game_name in games:
+                file_reader = WSGDrivers.Reader(game_name)
+                file_reader.load()
+                if file_reader.rom is None:
+                    print('%s: no ROM data' % game_name)
+                    continue
+                shared_rom = None
+                if not flat_path:
+                    shared_rom = SharedRom(file_reader)
+                    shared_roms.append(shared_rom)
+                sample_bank = None
+                timelines = {}
+                if pack and chip_name != 'wsg':
+                    # the songs of a pack are read here for the bank, the workers convert the timelines
+                    sample_bank, timelines = read_pack(game_name, file_reader, chip_name)
+                game_path = os.path.join(output_path, game_name)
+                os.makedirs(game_path, exist_ok=True)
+                for song_nr in range(file_reader.total_songs):
+                    if sample_bank is not None and song_nr not in timelines:
+                        continue
+                    futures.append((game_name, song_nr, executor.submit(convert_shared, game_name, song_nr, game_path,
+                                                                        solo, shared_rom, flat_path, stream, compress,
+                                                                        optimize, sample_bank, chip_name,
+                                                                        timelines.pop(song_nr, None))))
+
+            for game_name, song_nr, future in futures:
+                e = future.exception()
+                if e:
+                    print('%s song %d failed: %s' % (game_name, song_nr, e))
+    finally:
+        for shared_rom in shared_roms:
+            shared_rom.close()
+
+
+if __name__ == '__main__':
+    # Initiate the parser
+    parser = argparse.ArgumentParser('Play Namco 15XX sound files')
+
+    parser.add_argument('filename', nargs='?')
+    parser.add_argument('song_nr', nargs='?', type=int, default=-1)
+    parser.add_argument("--solo", "-s", nargs='+', type=int)
+    parser.add_argument("--batch", "-b", nargs='+', metavar='GAME',
+                        help="convert all songs of the listed games, 'all' for every configured game")
+    parser.add_argument("--output", "-o", default='', help='output directory')
+    parser.add_argument("--rom-cache", help='directory keeping the assembled ROM images between runs')
+    parser.add_argument("--flat", help='directory of flat ROM images, memory mapped instead of reading the zips. '
+                                           'Missing images are exported there on first use')
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help='number of worker processes for --batch, 0 for one per CPU core')
+    parser.add_argument("--stream", action='store_true',
+                        help='write the VGM to disk while converting and gzip it in a second pass, for long songs')
+    parser.add_argument("--vgm", action='store_true', help='write uncompressed .vgm files')
+    parser.add_argument("--optimize", "-O", action='store_true',
+                        help='drop redundant register writes and use the short wait commands')
+    parser.add_argument("--chip", "-c", choices=sorted(VGM.chips) + ['wsg'], default='c352',
+                        help="output chip, 'wsg' writes the WSG registers as they are (see WSGLog)")
+    parser.add_argument("--pack", action='store_true',
+                        help='with --batch, one sample bank per game shared by all of its songs')
+    parser.add_argument("--stats", metavar='FILE',
+                        help='write the time, events, bytes of each conversion stage as JSON (not of --jobs workers)')
+    parser.add_argument("--stats-memory", action='store_true', help='add the peak memory of each stage to --stats')
+    parser.add_argument("--profile", metavar='FILE', help='write a cProfile dump, to be read with pstats')
+
+    args = parser.parse_args()
+
+    if args.rom_cache:
+        WSGDrivers.Reader.rom_cache.path = args.rom_cache
+    if args.flat:
+        WSGDrivers.Reader.flat_path = args.flat
+    if args.stats:
+        WSGProfile.enable(args.stats_memory)
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.batch:
+        games = WSGDrivers.Reader.game_names() if 'all' in args.batch else args.batch
+        # one directory per game as song titles are not unique across games
+        if args.jobs != 1:
+            convert_games_parallel(games, args.output, args.solo, args.jobs or None, args.stream, not args.vgm,
+                                   args.optimize, args.pack, args.chip)
+        else:
+            for game_name in games:
+                output_path = os.path.join(args.output, game_name)
+                os.makedirs(output_path, exist_ok=True)
+                convert_game(game_name, output_path, args.solo, args.stream, not args.vgm, args.optimize,
+                             args.pack, args.chip)
+    elif args.filename:
+        # read data from rom
+        file_reader = WSGDrivers.Reader(args.filename)
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        write_song(file_reader, args.song_nr, args.output, args.solo, args.stream, not args.vgm, args.optimize,
+                   chip_name=args.chip)
+    else:
+        parser.error('a game name or --batch is required')
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.stats:
+        WSGProfile.profile.Write(args.stats)
@@ -0,0 +1,24 @@
+import WSGDrivers
+import WSGRender
+import WSG
+import argparse
+
+
+# Initiate the parser
+parser = argparse.ArgumentParser('Render Namco 15XX sound files to WAV')
+
+parser.add_argument('filename')
+parser.add_argument('song_nr', type=int)
+parser.add_argument("--solo", "-s", nargs='+', type=int)
+parser.add_argument("--rate", "-r", type=int, choices=[44100, 48000], default=44100)
+parser.add_argument("--block", "-b", type=int, default=4096, help='frames per block written to the file')
+parser.add_argument("--output", "-o", help='output file name')
+
+args = parser.parse_args()
+
+# read data from rom
+file_reader = WSGDrivers.Reader(args.filename)
+rows = WSG.iter_rows(file_reader.read(args.song_nr))
+
+renderer = WSGRender.Renderer(args.rate, args.block, args.solo)
+renderer.Render(rows, args.output or '{:s} {:02d}.wav'.format(args.filename, args.song_nr))